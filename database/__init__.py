@@ -1,2 +1,3 @@
 from database.mappings import *
-from database.connection import *
\ No newline at end of file
+from database.connection import *
+from database.gazetteer import Gazetteer
\ No newline at end of file
@@ -0,0 +1,92 @@
+"""
+    Asyncio version of DataBaseView, for fetch pipelines running on an event loop.
+"""
+from sqlalchemy import select, delete, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+from database import spatial
+from database.connection import DataBaseView, duplicate_entry
+
+
+class AsyncDataBaseView:
+    """Async db connection, every call runs in a session of its own"""
+    def __init__(self, access=None, echo=False, url=None, pool_size=10, max_overflow=20, pool_recycle=3600):
+        """
+        :param access: settings with the connection_string dict, used when no url is given
+        :param echo: bool, log every statement
+        :param url: string, database url, e.g. "sqlite+aiosqlite:///local.db" for local runs and tests
+        """
+        options = {"echo": echo}
+        if url is None:
+            conf = access.connection_string
+            driver = conf.get("dbasyncdriver", "aiomysql")
+            url = "mysql+" + driver + "://" + conf["dbuser"] + ":" + conf["dbpass"] + "@" + \
+                  conf["dbhost"] + ":" + conf["dbport"] + "/" + conf["dbname"] + "?charset=utf8"
+            options.update({"pool_size": pool_size, "max_overflow": max_overflow, "pool_recycle": pool_recycle,
+                            "pool_pre_ping": True})
+        self.engine = create_async_engine(url, **options)
+        # rows stay readable after the session that loaded them is closed
+        self.sessionmaker = sessionmaker(self.engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+    async def close(self):
+        """Close all pooled connections."""
+        await self.engine.dispose()
+
+    # multiple select
+    async def index(self, cls, match_filter=None, filter_mode="match", columns=None, limit=None, eager=None):
+        """Get all items. select equivalent. Relationships can't lazy load here, they have to be in eager"""
+        items = select(cls).options(*DataBaseView.load_options(cls, columns, eager))
+        items = DataBaseView.filter_query(cls, items, match_filter, filter_mode)
+        if limit:
+            items = items.limit(int(limit))
+        async with self.sessionmaker() as session:
+            result = await session.execute(items)
+            return result.scalars().all()
+
+    # single select
+    async def get(self, cls, match_filter=None, filter_mode="match", eager=None):
+        """Get an item. select equivalent"""
+        item = select(cls).options(*DataBaseView.load_options(cls, eager=eager))
+        item = DataBaseView.filter_query(cls, item, match_filter, filter_mode).limit(1)
+        async with self.sessionmaker() as session:
+            result = await session.execute(item)
+            return result.scalars().first()
+
+    # insert
+    async def post(self, data):
+        """Insert a new item. insert equivalent"""
+        async with self.sessionmaker() as session:
+            await session.merge(data)
+            try:
+                await session.commit()
+            except IntegrityError as e:
+                await session.rollback()
+                if not duplicate_entry(e):
+                    print(e)
+                    raise
+
+    # delete
+    async def delete(self, cls, match_id):
+        """Delete an item. delete equivalent"""
+        async with self.sessionmaker() as session:
+            try:
+                await session.execute(delete(cls).where(cls.id == match_id))
+                await session.commit()
+            except Exception:
+                await session.rollback()
+                raise
+
+    # update
+    async def put(self, cls, match_id, data):
+        """Update an item. update equivalent"""
+        # core updates skip the mapper events, the geohash cell is added here
+        data = spatial.with_geohash(cls, dict(data))
+        async with self.sessionmaker() as session:
+            try:
+                await session.execute(update(cls).where(cls.id == match_id).values(data)
+                                      .execution_options(synchronize_session=False))
+                await session.commit()
+            except Exception:
+                await session.rollback()
+                raise
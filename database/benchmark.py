@@ -0,0 +1,127 @@
+"""
+    Timing of the lookup queries done by ScrapeManager.dump_2, ScrapeManager.transfer_table and
+    WordPressManager.update_post_wp. Run it before and after DataBaseView.migrate to compare:
+        python -m database.benchmark
+    Timing of the ORM and plain row modes of DataBaseView.index, on a local sqlite table:
+        python -m database.benchmark rows
+    Size and read speed of the content columns, plain and compressed:
+        python -m database.benchmark compression
+"""
+import sys
+from time import perf_counter
+from sqlalchemy import text, select, type_coerce, LargeBinary
+from database.mappings import *
+from database.types import pack, unpack
+
+
+def time_query(connection, query, params, repeat=20):
+    """Average time in ms of a query, with the index mysql picks for it."""
+    with connection.engine.connect() as conn:
+        start = perf_counter()
+        for i in range(repeat):
+            conn.execute(text(query), params).fetchall()
+        elapsed = (perf_counter() - start) * 1000 / repeat
+        plan = conn.execute(text("EXPLAIN " + query), params).mappings().first()
+    return elapsed, plan["key"] if plan else None
+
+
+def lookups(connection):
+    """Lookup queries with sample values taken from the current data."""
+    church = connection.get(Church, {"geo_hash_id": "error"}, "exclude")
+    interest = connection.get(InterestPoint)
+    city = connection.get(City)
+    county = connection.get(County)
+    return [
+        ("dump_2 county by code", "SELECT * FROM account_county WHERE code = :code", {"code": county.code}),
+        ("dump_2 county by name", "SELECT * FROM account_county WHERE name = :name", {"name": county.name}),
+        ("dump_2 church count by county", "SELECT COUNT(*) FROM biserici_romania WHERE county_id = :county_id",
+         {"county_id": county.id}),
+        ("dump_2 church by url", "SELECT * FROM biserici_romania WHERE url = :url", {"url": church.url}),
+        ("dump_2 city by name and county", "SELECT * FROM account_city WHERE name = :name AND county_id = :county_id",
+         {"name": city.name, "county_id": city.county_id}),
+        ("transfer_table interest by coordinates",
+         "SELECT * FROM interest_points WHERE latitude = :latitude AND longitude = :longitude AND city_id = :city_id",
+         {"latitude": interest.latitude, "longitude": interest.longitude, "city_id": interest.city_id}),
+        ("transfer_table platforms by geo_hash_id",
+         "SELECT * FROM interest_points_platform WHERE geo_hash_id = :geo_hash_id",
+         {"geo_hash_id": interest.geo_hash_id}),
+        ("update_post_wp interest by coordinates",
+         "SELECT * FROM interest_points WHERE latitude = :latitude AND longitude = :longitude",
+         {"latitude": interest.latitude, "longitude": interest.longitude}),
+        ("nearest interest by geohash cell", "SELECT * FROM interest_points WHERE geohash LIKE :cell",
+         {"cell": (interest.geohash or "")[:6] + "%"}),
+        ("update_post_wp interest by place_id", "SELECT * FROM interest_points WHERE place_id = :place_id",
+         {"place_id": interest.place_id}),
+    ]
+
+
+def run(connection, repeat=20):
+    """Print the average time and the used index of every lookup."""
+    for name, query, params in lookups(connection):
+        elapsed, key = time_query(connection, query, params, repeat)
+        print("{:<45} {:>9.3f} ms  index: {}".format(name, elapsed, key))
+
+
+def run_rows(size=100000, repeat=3):
+    """Print the time index takes to read the coordinates and url of size rows, in every mode."""
+    from database.connection import DataBaseView
+    connection = DataBaseView(url="sqlite://")
+    Church.__table__.create(connection.engine)
+    connection.session.execute(Church.__table__.insert(), [
+        {"title": "Biserica {}".format(k), "url": "/biserica-{}".format(k), "latitude": 45 + k / size,
+         "longitude": 25 + k / size, "city_id": k % 300, "photo_cnt": k % 7} for k in range(size)])
+    connection.session.commit()
+    columns = ["latitude", "longitude", "url"]
+    modes = [("orm", {}), ("orm load_only", {"columns": columns}), ("tuple", {"columns": columns, "rows": "tuple"}),
+             ("named", {"columns": columns, "rows": "named"}), ("columns", {"columns": columns, "rows": "columns"})]
+    for name, options in modes:
+        best = None
+        for k in range(repeat):
+            # a fresh session each time, so the orm modes don't reuse an identity map
+            connection.registry.remove()
+            start = perf_counter()
+            connection.index(Church, **options)
+            elapsed = perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print("{:<15} {:>9.1f} ms  {:>10.0f} rows/s".format(name, best * 1000, size / best))
+
+
+def run_compression(connection, sample=2000, repeat=5):
+    """
+    Print the plain and compressed size of a sample of every content table, with the time a read
+    of the sample takes in both forms: fetching the stored bytes and decoding them to str.
+    """
+    for cls in (InterestPointContent, InterestPointFacility, BookingListingContent, BookingListingFacility):
+        column = cls.__table__.c.content
+        # the stored bytes, without the decoding done by CompressedText
+        statement = select(type_coerce(column, LargeBinary)).where(column.isnot(None)).limit(sample)
+        values = [unpack(row[0]) for row in connection.session.execute(statement)]
+        if not values:
+            continue
+        plain = [value.encode("utf8") for value in values]
+        packed = [pack(value) for value in values]
+        plain_size, packed_size = sum(len(x) for x in plain), sum(len(x) for x in packed)
+        timings = []
+        for stored, decode in ((plain, lambda x: x.decode("utf8")), (packed, unpack)):
+            start = perf_counter()
+            for k in range(repeat):
+                for value in stored:
+                    decode(value)
+            timings.append((perf_counter() - start) / repeat)
+        print("{:<26} rows: {:>6}  plain: {:>10} B  compressed: {:>10} B  ratio: {:>5.2f}  "
+              "decode plain: {:>8.1f} MB/s  compressed: {:>8.1f} MB/s".format(
+                cls.__tablename__, len(values), plain_size, packed_size, plain_size / packed_size,
+                plain_size / timings[0] / 1e6, plain_size / timings[1] / 1e6))
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ["rows"]:
+        run_rows()
+    elif sys.argv[1:] == ["compression"]:
+        from assets import access
+        from database.connection import DataBaseView
+        run_compression(DataBaseView(access.Settings))
+    else:
+        from assets import access
+        from database.connection import DataBaseView
+        run(DataBaseView(access.Settings))
@@ -1,68 +1,292 @@
 """
     Module used for database connection. All operations on the database should be handled in here
 """
-from sqlalchemy import MetaData, engine_from_config, not_
+from contextlib import contextmanager
+from datetime import datetime
+from importlib.util import spec_from_file_location, module_from_spec
+from os import listdir
+from os.path import join, dirname
+from threading import current_thread
+from weakref import finalize
+from sqlalchemy import MetaData, engine_from_config, not_, or_, inspect, bindparam, text, func, select
+from sqlalchemy.dialects.mysql import insert
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import scoped_session, sessionmaker, load_only
+from sqlalchemy.orm import scoped_session, sessionmaker, load_only, joinedload, selectinload
+from database import spatial
+from database.instrumentation import QueryStats, instrumented
+from database.search import TrigramIndex
+
+try:
+    # the current greenlet is unique per greenlet and per thread, gevent workers get sessions of their own
+    from greenlet import getcurrent
+except ImportError:
+    getcurrent = current_thread
+
+
+def duplicate_entry(error):
+    """True if an IntegrityError is a mysql 1062 duplicate entry, whatever the driver."""
+    code = getattr(error.orig, "errno", None)
+    if code is None and error.orig.args:
+        code = error.orig.args[0]
+    return code == 1062 or "UNIQUE constraint failed" in str(error.orig)
+
+
+WATERMARK_FORMAT = "%Y-%m-%d %H:%M:%S"
 
 
 class DataBaseView:
     """Db connection"""
-    def __init__(self, access, echo=False):
-        conf = access.connection_string
-        config = {"sqlalchemy.url": "mysql+mysqlconnector://" + conf["dbuser"] + ":" + conf["dbpass"] + "@" +
-                                    conf["dbhost"] + ":" + conf["dbport"] + "/" + conf["dbname"] + "?charset=utf8",
-                  "sqlalchemy.echo": str(echo)}
+    def __init__(self, access=None, echo=False, pool_size=10, max_overflow=20, pool_recycle=3600, pool_pre_ping=True,
+                 slow_query_ms=500, url=None):
+        """
+        :param access: settings with the connection_string dict, used when no url is given
+        :param echo: bool, log every statement
+        :param pool_size: int, connections kept open, at least the number of parallel workers
+        :param max_overflow: int, extra connections opened under load and closed when returned
+        :param pool_recycle: int, seconds after which a connection is replaced, below mysql wait_timeout
+        :param pool_pre_ping: bool, test connections on checkout and replace the dropped ones
+        :param slow_query_ms: float, statements slower than this go to the slow query log of self.stats
+        :param url: string, database url, e.g. "sqlite:///local.db" for local runs and benchmarks
+        """
+        config = {"sqlalchemy.url": url, "sqlalchemy.echo": str(echo)}
+        if url is None:
+            conf = access.connection_string
+            # server side cursors (iter_index) need a driver that supports them, e.g. pymysql or mysqldb
+            driver = conf.get("dbdriver", "mysqlconnector")
+            config.update({"sqlalchemy.url": "mysql+" + driver + "://" + conf["dbuser"] + ":" + conf["dbpass"] + "@" +
+                                             conf["dbhost"] + ":" + conf["dbport"] + "/" + conf["dbname"] +
+                                             "?charset=utf8",
+                           "sqlalchemy.pool_size": pool_size,
+                           "sqlalchemy.max_overflow": max_overflow,
+                           "sqlalchemy.pool_recycle": pool_recycle,
+                           "sqlalchemy.pool_pre_ping": pool_pre_ping})
         metadata = MetaData()
         engine = engine_from_config(config)
-        session = scoped_session(sessionmaker(autoflush=False, autocommit=False, bind=engine))
-        self.session = session()
+        self.engine = engine
+        self.scopes = set()
+        self.registry = scoped_session(sessionmaker(autoflush=False, autocommit=False, bind=engine),
+                                       scopefunc=self.scope)
+        self.search_indexes = {}
+        self.stats = QueryStats(engine, slow_query_ms)
         metadata.create_all(bind=engine)
 
-    # multiple select
-    def index(self, cls, match_filter=None, filter_mode="match", columns=None, limit=None):
-        """Get all items. select equivalent"""
-        items = self.session.query(cls)
-        if columns:
-            items = items.options(load_only(*columns))
+    def scope(self):
+        """
+        Registry key of the current thread or greenlet. Its session is released when the thread or greenlet
+        is garbage collected, so workers that end without removing their session don't keep a connection.
+        """
+        current = getcurrent()
+        key = id(current)
+        if key not in self.scopes:
+            self.scopes.add(key)
+            finalize(current, self.release, key)
+        return key
+
+    def release(self, key):
+        """Close the session of an ended thread or greenlet, its connection goes back to the pool."""
+        self.scopes.discard(key)
+        session = self.registry.registry.registry.pop(key, None)
+        if session is not None:
+            session.close()
+
+    @property
+    def session(self):
+        """
+        Session of the current thread or greenlet, it holds a pooled connection until it is committed, rolled back
+        or closed, read only calls included. Workers run their calls in unit_of_work() or call registry.remove()
+        when they are done; sessions of ended workers are only released once they are garbage collected.
+        """
+        return self.registry()
+
+    @contextmanager
+    def unit_of_work(self):
+        """
+        Session of the current thread or greenlet, committed at the end of the block and rolled back on errors.
+        A session opened by the block is closed with it, so short lived workers don't leave sessions behind.
+        """
+        created = not self.registry.registry.has()
+        session = self.registry()
+        try:
+            yield session
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            if created:
+                self.registry.remove()
+
+    @staticmethod
+    def filter_query(cls, query, match_filter=None, filter_mode="match"):
+        """Apply a match, like or exclude filter to a query."""
         if match_filter:
             if filter_mode == "like":
                 for attr, value in match_filter.items():
                     if isinstance(value, str):
-                        items = items.filter(getattr(cls, attr).like("%{}%".format(value)))
+                        query = query.filter(getattr(cls, attr).like("%{}%".format(value)))
                     else:
-                        items = items.filter(getattr(cls, attr) == value)
+                        query = query.filter(getattr(cls, attr) == value)
             elif filter_mode == "exclude":
                 for attr, value in match_filter.items():
                     if isinstance(value, str):
-                        items = items.filter(not_(getattr(cls, attr).like("%{}%".format(value))))
+                        query = query.filter(not_(getattr(cls, attr).like("%{}%".format(value))))
                     else:
-                        items = items.filter(getattr(cls, attr).isnot(value))
+                        query = query.filter(getattr(cls, attr).isnot(value))
             else:
-                items = items.filter_by(**match_filter)
+                query = query.filter_by(**match_filter)
+        return query
+
+    @staticmethod
+    def load_options(cls, columns=None, eager=None):
+        """
+        Loader options for the selected columns and the relationships loaded with the items.
+        Collections are loaded with one extra select for all items, many to one relationships with a join.
+        :param columns: list, column names to load
+        :param eager: list, relationship names, nested ones as dotted paths, e.g. ["platforms", "city.county"]
+        """
+        options = [load_only(*columns)] if columns else []
+        for path in eager or []:
+            option, entity = None, cls
+            for name in path.split("."):
+                attr = getattr(entity, name)
+                loader = selectinload if attr.property.uselist else joinedload
+                option = loader(attr) if option is None else getattr(option, loader.__name__)(attr)
+                entity = attr.property.mapper.class_
+            options.append(option)
+        return options
+
+    @classmethod
+    def column_select(cls_, cls, match_filter=None, filter_mode="match", columns=None):
+        """Core select of plain columns of a table, with the same filters as index."""
+        table = cls.__table__
+        statement = select(*[table.c[column] for column in columns] if columns else table.c)
+        return cls_.filter_query(cls, statement, match_filter, filter_mode)
+
+    @staticmethod
+    def shape_rows(result, rows):
+        """
+        Plain rows of a core result, no ORM instances or identity map involved.
+        :param result: sqlalchemy result
+        :param rows: string, "tuple" for plain tuples, "named" for named tuples with attribute access,
+                     "columns" for a dict of column name and list of values
+        """
+        if rows == "tuple":
+            return [tuple(row) for row in result]
+        if rows == "columns":
+            names = list(result.keys())
+            values = list(zip(*result)) or [()] * len(names)
+            return {name: list(values[k]) for k, name in enumerate(names)}
+        return result.all()
+
+    # multiple select
+    @instrumented
+    def index(self, cls, match_filter=None, filter_mode="match", columns=None, limit=None, eager=None, rows=None):
+        """
+        Get all items. select equivalent
+        With rows set ("tuple", "named" or "columns") only the columns are read, see shape_rows, which is
+        much cheaper than building ORM instances for read only loops.
+        """
+        if rows:
+            statement = self.column_select(cls, match_filter, filter_mode, columns)
+            if limit:
+                statement = statement.limit(int(limit))
+            return self.shape_rows(self.session.execute(statement), rows)
+        items = self.session.query(cls)
+        items = items.options(*self.load_options(cls, columns, eager))
+        items = self.filter_query(cls, items, match_filter, filter_mode)
         if limit:
             items = items.limit(int(limit))
         return items.all()
 
+    # streamed select
+    @instrumented
+    def iter_index(self, cls, match_filter=None, filter_mode="match", columns=None, chunk_size=1000, eager=None,
+                   rows=None):
+        """
+        Iterate over all items, fetched in chunks. streamed select equivalent.
+        Rows are read through a server side cursor on a session of their own, so the main session stays free
+        for writes while iterating. Lazy relationships can't be loaded while the cursor is open.
+        :param cls: mapped class of the items
+        :param match_filter: dict, same as index
+        :param filter_mode: string, "match", "like" or "exclude"
+        :param columns: list, column names to load
+        :param chunk_size: int, number of rows built and held in memory at once
+        :param eager: list, relationships loaded with the rows, only many to one ones can share the cursor
+        :param rows: string, "tuple" or "named" to stream plain rows instead of ORM instances
+        """
+        if rows:
+            statement = self.column_select(cls, match_filter, filter_mode, columns)
+            with self.engine.connect() as conn:
+                result = conn.execution_options(stream_results=True).execute(statement)
+                for partition in result.partitions(chunk_size):
+                    for row in partition:
+                        yield tuple(row) if rows == "tuple" else row
+            return
+        session = sessionmaker(autoflush=False, autocommit=False, bind=self.engine)()
+        try:
+            items = session.query(cls)
+            items = items.options(*self.load_options(cls, columns, eager))
+            items = self.filter_query(cls, items, match_filter, filter_mode)
+            items = items.execution_options(stream_results=True).yield_per(chunk_size)
+            for item in items:
+                yield item
+        finally:
+            session.close()
+
+    stream = iter_index
+
+    # keyset page select
+    @instrumented
+    def page(self, cls, match_filter=None, filter_mode="match", columns=None, limit=1000, cursor=None, eager=None):
+        """
+        Get one page of items ordered by primary key. seek pagination equivalent.
+        Every page costs the same, the previous page is located by id instead of being skipped with an offset.
+        :param cls: mapped class of the items
+        :param match_filter: dict, same as index
+        :param filter_mode: string, "match", "like" or "exclude"
+        :param columns: list, column names to load
+        :param limit: int, page size
+        :param cursor: string, token returned with the previous page, None for the first page
+        :param eager: list, relationship names loaded with the items, same as index
+        :return: tuple, list of items and the token of the next page, None after the last page
+        """
+        items = self.session.query(cls)
+        items = items.options(*self.load_options(cls, columns, eager))
+        items = self.filter_query(cls, items, match_filter, filter_mode)
+        if cursor:
+            items = items.filter(cls.id > self.decode_cursor(cls, cursor))
+        items = items.order_by(cls.id).limit(int(limit)).all()
+        next_cursor = self.encode_cursor(cls, items[-1].id) if len(items) == int(limit) else None
+        return items, next_cursor
+
+    def iter_pages(self, cls, match_filter=None, filter_mode="match", columns=None, limit=1000, cursor=None,
+                   eager=None):
+        """Iterate over pages of items. Yields tuples of items and the token that resumes after them."""
+        while True:
+            items, cursor = self.page(cls, match_filter, filter_mode, columns, limit, cursor, eager)
+            yield items, cursor
+            if cursor is None:
+                break
+
+    @staticmethod
+    def encode_cursor(cls, last_id):
+        """Cursor token for the rows after last_id."""
+        return "{}:{}".format(cls.__tablename__, last_id)
+
+    @staticmethod
+    def decode_cursor(cls, cursor):
+        """Last id of a cursor token, the token has to belong to the table of cls."""
+        table, _, last_id = cursor.rpartition(":")
+        if table != cls.__tablename__:
+            raise ValueError("Cursor {} doesn't belong to table {}".format(cursor, cls.__tablename__))
+        return int(last_id)
+
     # single select
-    def get(self, cls, match_filter=None, filter_mode="match"):
+    @instrumented
+    def get(self, cls, match_filter=None, filter_mode="match", eager=None):
         """Get an item. select equivalent"""
-        item = self.session.query(cls)
-        if match_filter:
-            if filter_mode == "like":
-                for attr, value in match_filter.items():
-                    if isinstance(value, str):
-                        item = item.filter(getattr(cls, attr).like("%{}%".format(value)))
-                    else:
-                        item = item.filter(getattr(cls, attr) == value)
-            elif filter_mode == "exclude":
-                for attr, value in match_filter.items():
-                    if isinstance(value, str):
-                        item = item.filter(not_(getattr(cls, attr).like("%{}%".format(value))))
-                    else:
-                        item = item.filter(getattr(cls, attr).isnot(value))
-            else:
-                item = item.filter_by(**match_filter)
+        item = self.session.query(cls).options(*self.load_options(cls, eager=eager))
+        item = self.filter_query(cls, item, match_filter, filter_mode)
         try:
             item = item.first()
         except Exception as e:
@@ -72,7 +296,139 @@ class DataBaseView:
         # except MultipleResultsFound:
         return item
 
+    # count
+    @instrumented
+    def count(self, cls, match_filter=None, filter_mode="match"):
+        """Count items. select count equivalent"""
+        items = self.filter_query(cls, self.session.query(cls), match_filter, filter_mode)
+        return items.with_entities(func.count(cls.id)).scalar()
+
+    # exists
+    @instrumented
+    def exists(self, cls, match_filter=None, filter_mode="match"):
+        """Check if an item matches. select exists equivalent"""
+        items = self.filter_query(cls, self.session.query(cls), match_filter, filter_mode)
+        return self.session.query(items.exists()).scalar()
+
+    @instrumented
+    def existing_keys(self, cls, column, values, chunk_size=1000):
+        """
+        Find which values of a column are already stored, with one query per chunk of values.
+        :param cls: mapped class
+        :param column: string, column name, e.g. "url" or "hotel_id"
+        :param values: list, values to check
+        :param chunk_size: int, number of values sent in one IN list
+        :return: set, the values found in the table
+        """
+        attr = getattr(cls, column)
+        values = list(set(x for x in values if x is not None))
+        found = set()
+        for start in range(0, len(values), chunk_size):
+            rows = self.session.query(attr).filter(attr.in_(values[start:start + chunk_size]))
+            found.update(row[0] for row in rows)
+        return found
+
+    # delta select
+    @instrumented
+    def changed_since(self, cls, watermark=None, match_filter=None, filter_mode="match", columns=None, eager=None):
+        """
+        Get the items created or updated after a watermark, the oldest change first.
+        updated_at has a one second resolution, the items changed in the second of the watermark are returned
+        again, so a change made while the previous call was reading is never missed.
+        :param cls: mapped class with an updated_at column
+        :param watermark: datetime or "%Y-%m-%d %H:%M:%S" string returned by the previous call, None for all items
+        :param match_filter: dict, same as index
+        :param filter_mode: string, "match", "like" or "exclude"
+        :param columns: list, column names to load
+        :param eager: list, relationship names loaded with the items, same as index
+        :return: tuple, list of items and the watermark to store for the next call
+        """
+        if isinstance(watermark, str):
+            watermark = datetime.strptime(watermark, WATERMARK_FORMAT)
+        items = self.session.query(cls)
+        items = items.options(*self.load_options(cls, columns and list(columns) + ["updated_at"], eager))
+        items = self.filter_query(cls, items, match_filter, filter_mode)
+        if watermark is not None:
+            items = items.filter(cls.updated_at >= watermark)
+        items = items.order_by(cls.updated_at, cls.id).all()
+        latest = max([item.updated_at for item in items if item.updated_at] or [watermark])
+        return items, latest.strftime(WATERMARK_FORMAT) if latest else None
+
+    # fuzzy select
+    @instrumented
+    def search(self, cls, query, column="title", limit=10, threshold=0.3):
+        """
+        Find items by a fuzzy match on a text column. The trigram index of the column is built on first use
+        and kept in memory, call search_index(cls, column, refresh=True) to pick up new rows.
+        :return: list, (item, score) tuples with the best score first
+        """
+        candidates = self.search_index(cls, column).search(query, limit, threshold)
+        if not candidates:
+            return []
+        items = {item.id: item for item in self.session.query(cls).filter(cls.id.in_([x[0] for x in candidates]))}
+        return [(items[item_id], score) for item_id, value, score in candidates if item_id in items]
+
+    def search_index(self, cls, column="title", refresh=False):
+        """Trigram index of a text column, built from a streamed scan of the table."""
+        key = (cls.__tablename__, column)
+        if refresh or key not in self.search_indexes:
+            rows = self.iter_index(cls, columns=[column])
+            self.search_indexes[key] = TrigramIndex((row.id, getattr(row, column)) for row in rows)
+        return self.search_indexes[key]
+
+    # radius select
+    @instrumented
+    def within_radius(self, cls, lat, lon, meters, match_filter=None, filter_mode="match", eager=None):
+        """
+        Get the items at most meters away from a point. Only the geohash cells around the point are read.
+        :param cls: mapped class with a geohash column
+        :param lat: float, latitude of the point
+        :param lon: float, longitude of the point
+        :param meters: float, radius
+        :param match_filter: dict, same as index
+        :param filter_mode: string, "match", "like" or "exclude"
+        :param eager: list, relationship names loaded with the items, same as index
+        :return: list, (item, distance in meters) tuples with the closest first
+        """
+        if lat is None or lon is None:
+            return []
+        precision = spatial.precision_for(lat, meters)
+        items = self.cell_items(cls, lat, lon, precision, match_filter, filter_mode, eager)
+        return [x for x in items if x[1] <= meters]
+
+    # nearest select
+    @instrumented
+    def nearest(self, cls, lat, lon, k=1, match_filter=None, filter_mode="match", eager=None, max_meters=None):
+        """
+        Get the k items closest to a point. The search starts with the cells of a few meters around the point
+        and widens them until the k-th item is closer than the edge of the searched cells.
+        :param k: int, number of items
+        :param max_meters: float, ignore items further away than this
+        :return: list, (item, distance in meters) tuples with the closest first
+        """
+        items = []
+        if lat is None or lon is None:
+            return items
+        for precision in range(spatial.precision_for(lat, 20), 0, -1):
+            reach = spatial.cell_meters(lat, precision)
+            items = self.cell_items(cls, lat, lon, precision, match_filter, filter_mode, eager)
+            if len(items) >= k and items[k - 1][1] <= reach or max_meters is not None and reach >= max_meters:
+                break
+        return [x for x in items[:k] if max_meters is None or x[1] <= max_meters]
+
+    def cell_items(self, cls, lat, lon, precision, match_filter=None, filter_mode="match", eager=None):
+        """Items in the 3x3 block of geohash cells of a precision around a point, with their distance to it."""
+        cells = spatial.block(lat, lon, precision)
+        items = self.session.query(cls).options(*self.load_options(cls, eager=eager))
+        # prefix matches are range scans of the geohash index
+        items = items.filter(or_(*[cls.geohash.like(cell + "%") for cell in cells]))
+        items = self.filter_query(cls, items, match_filter, filter_mode)
+        result = [(item, spatial.distance(lat, lon, item.latitude, item.longitude)) for item in items]
+        result.sort(key=lambda x: x[1])
+        return result
+
     # insert
+    @instrumented
     def post(self, data):
         """Insert a new item. insert equivalent"""
         self.session.merge(data)
@@ -80,11 +436,111 @@ class DataBaseView:
             self.session.commit()
         except IntegrityError as e:
             self.session.rollback()
-            if e.orig.errno != 1062:
+            if not duplicate_entry(e):
                 print(e)
                 raise
 
+    # bulk insert
+    @instrumented
+    def post_many(self, cls, items, chunk_size=500, upsert=True):
+        """
+        Insert many items of one mapped class. multi-row insert ... on duplicate key update equivalent.
+        Only the column attributes are written, relationships have to be posted separately.
+        :param cls: mapped class of the items
+        :param items: list of mapped objects or dicts with column values
+        :param chunk_size: int, number of rows sent in one statement and one transaction
+        :param upsert: bool, update existing rows on duplicate keys, otherwise duplicates are skipped
+        :return: dict, with the number of inserted, updated and skipped rows
+        """
+        report = {"inserted": 0, "updated": 0, "skipped": 0}
+        rows = [self.row_values(cls, item) for item in items]
+        for start in range(0, len(rows), chunk_size):
+            # multi-row inserts need the same column set for every row
+            groups = {}
+            for row in rows[start:start + chunk_size]:
+                groups.setdefault(tuple(sorted(row)), []).append(row)
+            # rows are only counted once their transaction is committed, a rollback undoes every group of the chunk
+            counts = dict.fromkeys(report, 0)
+            try:
+                for keys, group in groups.items():
+                    self.insert_rows(cls, keys, group, upsert, counts)
+                self.session.commit()
+            except IntegrityError as e:
+                self.session.rollback()
+                if not duplicate_entry(e):
+                    print(e)
+                    raise
+                # a duplicate key broke the batch, fall back to one row at a time for this chunk
+                for keys, group in groups.items():
+                    for row in group:
+                        counts = dict.fromkeys(report, 0)
+                        try:
+                            self.insert_rows(cls, keys, [row], upsert, counts)
+                            self.session.commit()
+                        except IntegrityError as e:
+                            self.session.rollback()
+                            if not duplicate_entry(e):
+                                print(e)
+                                raise
+                            report["skipped"] += 1
+                        else:
+                            self.add_counts(report, counts)
+            else:
+                self.add_counts(report, counts)
+        return report
+
+    def upsert_many(self, cls, items, chunk_size=500):
+        """Insert or update many items. insert ... on duplicate key update equivalent"""
+        return self.post_many(cls, items, chunk_size, upsert=True)
+
+    def insert_rows(self, cls, keys, rows, upsert, report):
+        """
+        Execute one multi-row insert and add its rows to the report. With upsert, a row counts as updated when
+        one of its unique keys was already stored, whether or not its values changed. Without upsert, duplicates
+        are skipped by the database and the rest of the batch is still inserted.
+        """
+        statement = insert(cls.__table__).values(rows)
+        primary_keys = [column.key for column in cls.__table__.primary_key]
+        update_keys = [key for key in keys if key not in primary_keys]
+        if upsert and update_keys:
+            statement = statement.on_duplicate_key_update({key: statement.inserted[key] for key in update_keys})
+            # mysql reports found rows, not changed ones, existing rows are counted before the insert instead
+            existing = self.existing_rows(cls, keys, rows)
+            self.session.execute(statement)
+            report["updated"] += existing
+            report["inserted"] += len(rows) - existing
+        else:
+            statement = statement.prefix_with("IGNORE", dialect="mysql").prefix_with("OR IGNORE", dialect="sqlite")
+            inserted = self.session.execute(statement).rowcount
+            report["inserted"] += inserted
+            report["skipped"] += len(rows) - inserted
+
+    @staticmethod
+    def add_counts(report, counts):
+        for key, value in counts.items():
+            report[key] += value
+
+    def existing_rows(self, cls, keys, rows):
+        """Number of rows with a primary or unique key value that is already stored."""
+        unique_keys = [column.key for column in cls.__table__.columns
+                       if (column.primary_key or column.unique) and column.key in keys]
+        found = {key: self.existing_keys(cls, key, [row[key] for row in rows]) for key in unique_keys}
+        return sum(1 for row in rows if any(row[key] in found[key] for key in unique_keys))
+
+    @staticmethod
+    def row_values(cls, item):
+        """Column values of a mapped object or dict, without the attributes that were never set."""
+        if isinstance(item, dict):
+            values = {key: value for key, value in item.items() if key in cls.__table__.columns}
+        else:
+            state = inspect(item)
+            values = {column.key: state.dict[column.key] for column in state.mapper.column_attrs
+                      if column.key in state.dict}
+        # core inserts skip the mapper events, the geohash cell is added here
+        return spatial.with_geohash(cls, values)
+
     # delete
+    @instrumented
     def delete(self, cls, match_id):
         """Delete an item. delete equivalent"""
         try:
@@ -95,11 +551,84 @@ class DataBaseView:
             raise
 
     # update
+    @instrumented
     def put(self, cls, match_id, data):
         """Update an item. update equivalent"""
         try:
+            data = spatial.with_geohash(cls, dict(data))
             self.session.query(cls).filter(cls.id == match_id).update(data, synchronize_session='fetch')
             self.session.commit()
         except Exception:
             self.session.rollback()
             raise
+
+    # bulk update
+    @instrumented
+    def put_many(self, cls, items):
+        """
+        Update many items in one transaction. executemany update equivalent, without fetch synchronization.
+        Items updating the same set of columns are sent as one executemany statement.
+        :param cls: mapped class of the items
+        :param items: list of (id, dict) tuples, later values for the same id override earlier ones
+        :return: int, number of matched rows
+        """
+        merged = {}
+        for match_id, data in items:
+            merged.setdefault(match_id, {}).update(data)
+        groups = {}
+        for match_id, data in merged.items():
+            if not data:
+                continue
+            data = spatial.with_geohash(cls, data)
+            params = {"b_" + key: value for key, value in data.items()}
+            params["b_id"] = match_id
+            groups.setdefault(tuple(sorted(data)), []).append(params)
+        table = cls.__table__
+        matched = 0
+        try:
+            for keys, params in groups.items():
+                # bind names can't be the column names, they are reserved for the SET clause
+                statement = table.update().where(table.c.id == bindparam("b_id"))
+                statement = statement.values({key: bindparam("b_" + key) for key in keys})
+                matched += self.session.execute(statement, params).rowcount
+            self.session.commit()
+        except Exception:
+            self.session.rollback()
+            raise
+        return matched
+
+    # schema migrations
+    def migrate(self, path=join(dirname(__file__), "migrations")):
+        """
+        Apply the migrations from path that weren't applied yet, in file name order.
+        .sql files are run statement by statement, .py files for data changes have to define upgrade(connection),
+        called with this DataBaseView. Applied migrations are recorded in the schema_migrations table.
+        :return: list, names of the applied migrations
+        """
+        with self.engine.begin() as conn:
+            conn.execute(text("CREATE TABLE IF NOT EXISTS schema_migrations "
+                              "(name VARCHAR(255) PRIMARY KEY, applied DATETIME DEFAULT CURRENT_TIMESTAMP)"))
+            applied = {row[0] for row in conn.execute(text("SELECT name FROM schema_migrations"))}
+        result = []
+        for name in sorted(f for f in listdir(path) if f.endswith((".sql", ".py"))):
+            if name in applied:
+                continue
+            if name.endswith(".py"):
+                spec = spec_from_file_location("migration_" + name[:-3], join(path, name))
+                module = module_from_spec(spec)
+                spec.loader.exec_module(module)
+                module.upgrade(self)
+                with self.engine.begin() as conn:
+                    conn.execute(text("INSERT INTO schema_migrations (name) VALUES (:name)"), {"name": name})
+                result.append(name)
+                continue
+            with open(join(path, name), "r", encoding="utf-8") as f:
+                script = "\n".join(line for line in f.read().split("\n") if not line.strip().startswith("--"))
+            # mysql commits every DDL statement on its own, a failed migration has to be finished by hand
+            with self.engine.begin() as conn:
+                for statement in script.split(";"):
+                    if statement.strip():
+                        conn.execute(text(statement))
+                conn.execute(text("INSERT INTO schema_migrations (name) VALUES (:name)"), {"name": name})
+            result.append(name)
+        return result
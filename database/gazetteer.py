@@ -0,0 +1,93 @@
+"""
+    In memory index of the account_county and account_city tables, used to resolve scraped locations.
+"""
+from slugify import slugify
+from database.mappings import City, County
+from database.search import TrigramIndex
+
+
+class Gazetteer:
+    """Counties and cities indexed by slugified name, county code and siruta code"""
+    def __init__(self, connection):
+        self.connection = connection
+        self.counties = {}
+        self.cities = {}
+        self.county_names = {}
+        self.county_codes = {}
+        self.city_names = {}
+        self.county_city_names = {}
+        self.city_sirutas = {}
+        self.city_index = TrigramIndex()
+        self.refresh()
+
+    def refresh(self):
+        """Reload both tables. The rows are detached from the session so commits don't expire them."""
+        counties = self.connection.index(County)
+        cities = self.connection.index(City)
+        for city in cities:
+            # many to one loads are served from the identity map, the counties were loaded above
+            city.county
+        for item in counties + cities:
+            self.connection.session.expunge(item)
+
+        self.counties = {county.id: county for county in counties}
+        self.cities = {city.id: city for city in cities}
+        self.county_names = {slugify(county.name): county for county in counties}
+        self.county_codes = {county.code.upper(): county for county in counties if county.code}
+        self.city_names = {}
+        self.county_city_names = {}
+        for city in sorted(cities, key=lambda x: x.id):
+            self.city_names.setdefault(slugify(city.name), []).append(city)
+            self.county_city_names.setdefault(city.county_id, {}).setdefault(slugify(city.name), []).append(city)
+        self.city_sirutas = {city.siruta: city for city in cities if city.siruta}
+        self.city_index = TrigramIndex((city.id, city.name) for city in cities)
+
+    def county(self, name=None, code=None):
+        """Find a county by name or by its code, None if there is no match."""
+        if code:
+            return self.county_codes.get(code.upper())
+        if name:
+            return self.county_names.get(slugify(name))
+        return None
+
+    def city(self, name=None, county_id=None, siruta=None, threshold=0.6):
+        """
+        Find a city by siruta code or by name. A name without exact match falls back to the first city
+        whose name contains it, like the "like" filter of DataBaseView.get, then to the closest spelling.
+        :param name: string, city name in any spelling
+        :param county_id: int, restrict the match to one county
+        :param siruta: int, siruta code of the city
+        :param threshold: float, minimum trigram score of the closest spelling
+        """
+        if siruta:
+            return self.city_sirutas.get(int(siruta))
+        key = slugify(name or "")
+        if not key:
+            return None
+        names = self.city_names if county_id is None else self.county_city_names.get(county_id, {})
+        if key in names:
+            return names[key][0]
+        matches = [cities[0] for city_key, cities in names.items() if key in city_key]
+        if matches:
+            return min(matches, key=lambda x: x.id)
+        allowed = None if county_id is None else {city.id for cities in names.values() for city in cities}
+        closest = self.city_index.search(key, 1, threshold, allowed)
+        return self.cities[closest[0][0]] if closest else None
+
+    def locate(self, city_name, county_name, default_county=None):
+        """
+        Resolve a scraped city and county pair. Bucharest is its own county, every other locality listed
+        under Bucuresti belongs to Ilfov.
+        :return: tuple, city and county, either can be None
+        """
+        city_key = slugify(city_name or "")
+        county_key = slugify(county_name or "")
+        if city_key == "bucuresti":
+            county_key = "bucuresti"
+        elif "bucuresti" in county_key:
+            county_key = "ilfov"
+        county = self.county_names.get(county_key) or default_county
+        city = self.city(city_key, county.id if county else None)
+        if city is not None and county is None:
+            county = city.county
+        return city, county
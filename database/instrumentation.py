@@ -0,0 +1,182 @@
+"""
+    Query statistics for DataBaseView: calls, latency histograms and rows per method and mapped class,
+    statements per call collected through engine events, and a slow query log.
+"""
+from contextvars import ContextVar
+from functools import wraps
+from inspect import isgeneratorfunction
+from threading import Lock
+from time import perf_counter
+from sqlalchemy import event
+
+# (method, mapped class) of the DataBaseView call running in the current thread, greenlet or task
+current_call = ContextVar("current_call", default=("raw", "-"))
+
+BUCKETS = (1, 5, 10, 50, 100, 500, 1000, float("inf"))
+
+
+def class_name(args):
+    """Name of the mapped class a call works on, from its first argument."""
+    if not args:
+        return "-"
+    subject = args[0]
+    return subject.__name__ if isinstance(subject, type) else type(subject).__name__
+
+
+def count_rows(result):
+    """Rows returned or written by a call, from its result."""
+    if result is None:
+        return 0
+    if isinstance(result, bool):
+        return int(result)
+    if isinstance(result, int):
+        return result
+    if isinstance(result, dict) and "inserted" in result:
+        return result["inserted"] + result["updated"]
+    if isinstance(result, dict):
+        return max([len(x) for x in result.values()] or [0])
+    if isinstance(result, tuple):
+        return count_rows(result[0])
+    if isinstance(result, (list, set)):
+        return len(result)
+    return 1
+
+
+def instrumented(method):
+    """Record every call of a DataBaseView method in its stats."""
+    if isgeneratorfunction(method):
+        @wraps(method)
+        def stream_wrapper(self, *args, **kwargs):
+            stats = getattr(self, "stats", None)
+            key = (method.__name__, class_name(args))
+            generator = method(self, *args, **kwargs)
+            elapsed, rows = 0.0, 0
+            try:
+                while True:
+                    # only the time spent fetching counts, not the time the caller spends on each row
+                    token = current_call.set(key)
+                    start = perf_counter()
+                    try:
+                        item = next(generator)
+                    except StopIteration:
+                        break
+                    finally:
+                        elapsed += perf_counter() - start
+                        current_call.reset(token)
+                    rows += 1
+                    yield item
+            finally:
+                generator.close()
+                if stats is not None:
+                    stats.record_call(key, elapsed, rows)
+        return stream_wrapper
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        stats = getattr(self, "stats", None)
+        if stats is None:
+            return method(self, *args, **kwargs)
+        key = (method.__name__, class_name(args))
+        token = current_call.set(key)
+        start = perf_counter()
+        result = None
+        try:
+            result = method(self, *args, **kwargs)
+            return result
+        finally:
+            current_call.reset(token)
+            stats.record_call(key, perf_counter() - start, count_rows(result))
+    return wrapper
+
+
+class QueryStats:
+    """Statistics of the calls and statements of one engine"""
+    def __init__(self, engine, slow_query_ms=500, slow_log_size=100):
+        """
+        :param engine: sqlalchemy engine, its statements are timed through cursor events
+        :param slow_query_ms: float, statements slower than this are kept in the slow query log
+        :param slow_log_size: int, number of slow statements kept, the oldest ones are dropped
+        """
+        self.slow_query_ms = slow_query_ms
+        self.slow_log_size = slow_log_size
+        self.lock = Lock()
+        self.reset()
+        event.listen(engine, "before_cursor_execute", self.before_execute)
+        event.listen(engine, "after_cursor_execute", self.after_execute)
+        event.listen(engine, "handle_error", self.failed_execute)
+
+    def reset(self):
+        """Forget everything recorded so far."""
+        self.calls = {}
+        self.slow_log = []
+
+    def entry(self, key):
+        return self.calls.setdefault(key, {"calls": 0, "time": 0.0, "rows": 0, "statements": 0, "errors": 0,
+                                           "statement_time": 0.0, "histogram": [0] * len(BUCKETS)})
+
+    def record_call(self, key, elapsed, rows):
+        """Add one finished call, elapsed in seconds."""
+        elapsed_ms = elapsed * 1000
+        with self.lock:
+            entry = self.entry(key)
+            entry["calls"] += 1
+            entry["time"] += elapsed_ms
+            entry["rows"] += rows
+            for k, bound in enumerate(BUCKETS):
+                if elapsed_ms < bound:
+                    entry["histogram"][k] += 1
+                    break
+
+    def before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(perf_counter())
+
+    def after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed_ms = (perf_counter() - conn.info["query_start"].pop()) * 1000
+        self.record_statement(elapsed_ms, statement, parameters if not executemany else "executemany")
+
+    def failed_execute(self, exception_context):
+        """A failing statement never reaches after_cursor_execute, its start is dropped from the connection here."""
+        conn = exception_context.connection
+        if conn is None or not conn.info.get("query_start"):
+            # failed before the cursor was executed, e.g. while connecting
+            return
+        elapsed_ms = (perf_counter() - conn.info["query_start"].pop()) * 1000
+        execution = exception_context.execution_context
+        parameters = exception_context.parameters
+        if execution is not None and execution.executemany:
+            parameters = "executemany"
+        self.record_statement(elapsed_ms, exception_context.statement, parameters, failed=True)
+
+    def record_statement(self, elapsed_ms, statement, parameters, failed=False):
+        """Add one statement to the stats of the running call, failed ones are also counted as errors."""
+        key = current_call.get()
+        with self.lock:
+            entry = self.entry(key)
+            entry["statements"] += 1
+            entry["statement_time"] += elapsed_ms
+            if failed:
+                entry["errors"] += 1
+            if elapsed_ms >= self.slow_query_ms:
+                self.slow_log.append((elapsed_ms, key, statement, parameters, failed))
+                del self.slow_log[:-self.slow_log_size]
+
+    def summary(self, slow=10):
+        """Report with one line per method and class, the hottest first, followed by the slowest statements."""
+        lines = ["{:<14} {:<24} {:>7} {:>11} {:>9} {:>9} {:>7} {:>10}  {}".format(
+            "method", "class", "calls", "total ms", "avg ms", "queries", "errors", "rows",
+            " ".join("<{}".format(b) if b != float("inf") else ">={}".format(BUCKETS[-2]) for b in BUCKETS))]
+        with self.lock:
+            items = sorted(self.calls.items(), key=lambda x: -max(x[1]["time"], x[1]["statement_time"]))
+            for (method, cls), entry in items:
+                calls = entry["calls"]
+                total = entry["time"] if calls else entry["statement_time"]
+                lines.append("{:<14} {:<24} {:>7} {:>11.1f} {:>9.2f} {:>9} {:>7} {:>10}  {}".format(
+                    method, cls, calls, total, total / calls if calls else 0, entry["statements"], entry["errors"],
+                    entry["rows"], " ".join(str(x) for x in entry["histogram"])))
+            slowest = sorted(self.slow_log, key=lambda x: -x[0])[:slow]
+        if slowest:
+            lines.append("slow queries (>= {} ms):".format(self.slow_query_ms))
+            for elapsed_ms, (method, cls), statement, parameters, failed in slowest:
+                lines.append("{:>9.1f} ms {}.{} : {}{} {}".format(elapsed_ms, method, cls, "failed " if failed else "",
+                                                                   " ".join(statement.split()), parameters))
+        return "\n".join(lines)
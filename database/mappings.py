@@ -1,28 +1,34 @@
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, String, ForeignKey, Float, DateTime
-from sqlalchemy.dialects.mysql import MEDIUMTEXT
+from sqlalchemy import Column, Integer, String, ForeignKey, Float, DateTime, Index, MetaData, event, func
 from sqlalchemy.orm import relationship
+from database import spatial
+from database.types import CompressedText
 
-Base = declarative_base()
+# constraint names have to match the ones created by database/migrations
+Base = declarative_base(metadata=MetaData(naming_convention={"ix": "ix_%(column_0_label)s",
+                                                             "uq": "uq_%(table_name)s_%(column_0_name)s"}))
 
 
 class BookingListing(Base):
     __tablename__ = 'booking_listings'
 
     id = Column(Integer, primary_key=True)
-    geo_hash_id = Column(String(64))
+    geo_hash_id = Column(String(64), index=True)
     title = Column(String(250), nullable=True)
     county_id = Column(Integer, ForeignKey('account_county.id'), nullable=True)
     type = Column(String(50), nullable=True)
     latitude = Column(Float, nullable=True)
     longitude = Column(Float, nullable=True)
+    geohash = Column(String(12), nullable=True, index=True)
     city_id = Column(Integer, ForeignKey('account_city.id'), nullable=True)
-    hotel_id = Column(Integer, nullable=True)
+    hotel_id = Column(Integer, nullable=True, unique=True)
     telephone = Column(String(12), nullable=True)
     address = Column(String(250), nullable=True)
     place_id = Column(String(50), nullable=True)
     photos = Column(String(250), nullable=True)
     status = Column(String(50), nullable=True)
+    created_at = Column(DateTime, nullable=True, server_default=func.now())
+    updated_at = Column(DateTime, nullable=True, server_default=func.now(), onupdate=func.now(), index=True)
     contents = relationship('BookingListingContent', backref='booking_listings_content')
     facilities = relationship('BookingListingFacility', backref='booking_listings_facility')
     platforms = relationship('BookingListingPlatform', backref='booking_listings_platform')
@@ -41,10 +47,10 @@ class BookingListingContent(Base):
     __tablename__ = 'booking_listings_content'
 
     id = Column(Integer, primary_key=True)
-    geo_hash_id = Column(String(64), ForeignKey('booking_listings.geo_hash_id'))
+    geo_hash_id = Column(String(64), ForeignKey('booking_listings.geo_hash_id'), index=True)
     type = Column(String(50))
     src_url = Column(String(255))
-    content = Column(MEDIUMTEXT)
+    content = Column(CompressedText)
 
     def __init__(self, *args, **kwargs):
         super(BookingListingContent, self).__init__(*args, **kwargs)
@@ -57,9 +63,9 @@ class BookingListingFacility(Base):
     __tablename__ = 'booking_listings_facility'
 
     id = Column(Integer, primary_key=True)
-    geo_hash_id = Column(String(64), ForeignKey('booking_listings.geo_hash_id'))
+    geo_hash_id = Column(String(64), ForeignKey('booking_listings.geo_hash_id'), index=True)
     type = Column(String(50))
-    content = Column(MEDIUMTEXT)
+    content = Column(CompressedText)
 
     def __init__(self, *args, **kwargs):
         super(BookingListingFacility, self).__init__(*args, **kwargs)
@@ -72,7 +78,7 @@ class BookingListingPlatform(Base):
     __tablename__ = 'booking_listings_platform'
 
     id = Column(Integer, primary_key=True)
-    geo_hash_id = Column(String(64), ForeignKey('booking_listings.geo_hash_id'))
+    geo_hash_id = Column(String(64), ForeignKey('booking_listings.geo_hash_id'), index=True)
     platform = Column(String(50))
     url = Column(String(255))
     avg_price = Column(String(10), nullable=True)
@@ -87,6 +93,7 @@ class BookingListingPlatform(Base):
 
 class City(Base):
     __tablename__ = 'account_city'
+    __table_args__ = (Index('ix_account_city_name_county_id', 'name', 'county_id'),)
 
     id = Column(Integer, primary_key=True)
     county_id = Column(Integer, ForeignKey('account_county.id'))
@@ -107,8 +114,8 @@ class County(Base):
     __tablename__ = 'account_county'
 
     id = Column(Integer, primary_key=True)
-    code = Column(String(2))
-    name = Column(String(64))
+    code = Column(String(2), unique=True)
+    name = Column(String(64), index=True)
     cities = relationship('City', backref='county')
     listings = relationship('BookingListing', backref='listing_county')
 
@@ -120,18 +127,21 @@ class Church(Base):
     __tablename__ = 'biserici_romania'
 
     id = Column(Integer, primary_key=True)
-    geo_hash_id = Column(String(64), nullable=True)
+    geo_hash_id = Column(String(64), nullable=True, index=True)
     title = Column(String(255))
     religion = Column(String(50), nullable=True)
     city_id = Column(Integer, ForeignKey('account_city.id'), nullable=True)
     county_id = Column(Integer, ForeignKey('account_county.id'), nullable=True)
     latitude = Column(Float, nullable=True)
     longitude = Column(Float, nullable=True)
+    geohash = Column(String(12), nullable=True, index=True)
     cod_lmi = Column(String(50), nullable=True)
     photo_cnt = Column(Integer, nullable=True)
-    url = Column(String(255), nullable=True)
+    url = Column(String(255), nullable=True, unique=True)
     address = Column(String(255), nullable=True)
     telephone = Column(String(15), nullable=True)
+    created_at = Column(DateTime, nullable=True, server_default=func.now())
+    updated_at = Column(DateTime, nullable=True, server_default=func.now(), onupdate=func.now(), index=True)
 
     def __init__(self, *args, **kwargs):
         super(Church, self).__init__(*args, **kwargs)
@@ -145,21 +155,25 @@ class Church(Base):
 
 class InterestPoint(Base):
     __tablename__ = 'interest_points'
+    __table_args__ = (Index('ix_interest_points_coordinates', 'latitude', 'longitude', 'city_id'),)
 
     id = Column(Integer, primary_key=True)
-    geo_hash_id = Column(String(64))
+    geo_hash_id = Column(String(64), index=True)
     title = Column(String(250), nullable=True)
     city_id = Column(Integer, ForeignKey('account_city.id'), nullable=True)
     types = Column(String(255), nullable=True)
     wp_post_id = Column(String(50), nullable=True)
     latitude = Column(Float, nullable=True)
     longitude = Column(Float, nullable=True)
+    geohash = Column(String(12), nullable=True, index=True)
     address_coord = Column(String(250), nullable=True)
     rate = Column(Float, nullable=True)
-    place_id = Column(String(50), nullable=True)
+    place_id = Column(String(50), nullable=True, index=True)
     photos = Column(String(250), nullable=True)
     status = Column(String(50), nullable=True)
     check = Column(String(50), nullable=True)
+    created_at = Column(DateTime, nullable=True, server_default=func.now())
+    updated_at = Column(DateTime, nullable=True, server_default=func.now(), onupdate=func.now(), index=True)
 
     contents = relationship('InterestPointContent', backref='interest_points_content')
     facilities = relationship('InterestPointFacility', backref='interest_points_facility')
@@ -179,7 +193,7 @@ class InterestPointPlatform(Base):
     __tablename__ = 'interest_points_platform'
 
     id = Column(Integer, primary_key=True)
-    geo_hash_id = Column(String(64), ForeignKey('interest_points.geo_hash_id'))
+    geo_hash_id = Column(String(64), ForeignKey('interest_points.geo_hash_id'), index=True)
     platform = Column(String(50))
     url = Column(String(255))
     avg_price = Column(String(10), nullable=True)
@@ -196,10 +210,10 @@ class InterestPointContent(Base):
     __tablename__ = 'interest_points_content'
 
     id = Column(Integer, primary_key=True)
-    geo_hash_id = Column(String(64), ForeignKey('interest_points.geo_hash_id'))
+    geo_hash_id = Column(String(64), ForeignKey('interest_points.geo_hash_id'), index=True)
     type = Column(String(50))
     src_url = Column(String(255))
-    content = Column(MEDIUMTEXT)
+    content = Column(CompressedText)
 
     def __init__(self, *args, **kwargs):
         super(InterestPointContent, self).__init__(*args, **kwargs)
@@ -212,12 +226,22 @@ class InterestPointFacility(Base):
     __tablename__ = 'interest_points_facility'
 
     id = Column(Integer, primary_key=True)
-    geo_hash_id = Column(String(64), ForeignKey('interest_points.geo_hash_id'))
+    geo_hash_id = Column(String(64), ForeignKey('interest_points.geo_hash_id'), index=True)
     type = Column(String(50))
-    content = Column(MEDIUMTEXT)
+    content = Column(CompressedText)
 
     def __init__(self, *args, **kwargs):
         super(InterestPointFacility, self).__init__(*args, **kwargs)
 
     def __repr__(self):
         return '<Facility id: {}, type: {}>'.format(self.id, self.type)
+
+
+@event.listens_for(Base, "before_insert", propagate=True)
+@event.listens_for(Base, "before_update", propagate=True)
+def set_geohash(mapper, connection, target):
+    """Keep the geohash cell of the tables that have one in step with the coordinates."""
+    if "geohash" in mapper.columns:
+        geohash = spatial.encode(target.latitude, target.longitude)
+        if target.__dict__.get("geohash") != geohash:
+            target.geohash = geohash
@@ -0,0 +1,26 @@
+-- Secondary indexes for the lookups done by the scrapers and the WordPress updater.
+-- The unique keys fail if duplicates already exist, find them first with:
+--   SELECT url, COUNT(*) FROM biserici_romania GROUP BY url HAVING COUNT(*) > 1;
+--   SELECT hotel_id, COUNT(*) FROM booking_listings GROUP BY hotel_id HAVING COUNT(*) > 1;
+--   SELECT code, COUNT(*) FROM account_county GROUP BY code HAVING COUNT(*) > 1;
+
+CREATE INDEX ix_account_county_name ON account_county (name);
+CREATE INDEX ix_account_city_name_county_id ON account_city (name, county_id);
+
+CREATE INDEX ix_biserici_romania_geo_hash_id ON biserici_romania (geo_hash_id);
+
+CREATE INDEX ix_interest_points_geo_hash_id ON interest_points (geo_hash_id);
+CREATE INDEX ix_interest_points_place_id ON interest_points (place_id);
+CREATE INDEX ix_interest_points_coordinates ON interest_points (latitude, longitude, city_id);
+CREATE INDEX ix_interest_points_content_geo_hash_id ON interest_points_content (geo_hash_id);
+CREATE INDEX ix_interest_points_facility_geo_hash_id ON interest_points_facility (geo_hash_id);
+CREATE INDEX ix_interest_points_platform_geo_hash_id ON interest_points_platform (geo_hash_id);
+
+CREATE INDEX ix_booking_listings_geo_hash_id ON booking_listings (geo_hash_id);
+CREATE INDEX ix_booking_listings_content_geo_hash_id ON booking_listings_content (geo_hash_id);
+CREATE INDEX ix_booking_listings_facility_geo_hash_id ON booking_listings_facility (geo_hash_id);
+CREATE INDEX ix_booking_listings_platform_geo_hash_id ON booking_listings_platform (geo_hash_id);
+
+ALTER TABLE account_county ADD CONSTRAINT uq_account_county_code UNIQUE (code);
+ALTER TABLE biserici_romania ADD CONSTRAINT uq_biserici_romania_url UNIQUE (url);
+ALTER TABLE booking_listings ADD CONSTRAINT uq_booking_listings_hotel_id UNIQUE (hotel_id);
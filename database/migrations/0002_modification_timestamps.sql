@@ -0,0 +1,13 @@
+-- created_at and updated_at of the core tables, for DataBaseView.changed_since.
+-- mysql maintains both for every writer, existing rows get the time of the migration.
+
+ALTER TABLE biserici_romania ADD COLUMN created_at DATETIME NULL DEFAULT CURRENT_TIMESTAMP,
+    ADD COLUMN updated_at DATETIME NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP;
+ALTER TABLE interest_points ADD COLUMN created_at DATETIME NULL DEFAULT CURRENT_TIMESTAMP,
+    ADD COLUMN updated_at DATETIME NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP;
+ALTER TABLE booking_listings ADD COLUMN created_at DATETIME NULL DEFAULT CURRENT_TIMESTAMP,
+    ADD COLUMN updated_at DATETIME NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP;
+
+CREATE INDEX ix_biserici_romania_updated_at ON biserici_romania (updated_at);
+CREATE INDEX ix_interest_points_updated_at ON interest_points (updated_at);
+CREATE INDEX ix_booking_listings_updated_at ON booking_listings (updated_at);
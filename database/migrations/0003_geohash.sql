@@ -0,0 +1,10 @@
+-- Geohash cell of the coordinates, for the radius and nearest lookups of DataBaseView.
+-- The existing rows are filled in by 0004_geohash_backfill.py.
+
+ALTER TABLE biserici_romania ADD COLUMN geohash VARCHAR(12) NULL;
+ALTER TABLE interest_points ADD COLUMN geohash VARCHAR(12) NULL;
+ALTER TABLE booking_listings ADD COLUMN geohash VARCHAR(12) NULL;
+
+CREATE INDEX ix_biserici_romania_geohash ON biserici_romania (geohash);
+CREATE INDEX ix_interest_points_geohash ON interest_points (geohash);
+CREATE INDEX ix_booking_listings_geohash ON booking_listings (geohash);
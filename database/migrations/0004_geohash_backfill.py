@@ -0,0 +1,15 @@
+"""
+    Fill the geohash column of the rows stored before 0003_geohash.sql.
+"""
+from database import spatial
+from database.mappings import Church, InterestPoint, BookingListing
+
+CHUNK = 1000
+
+
+def upgrade(connection):
+    for cls in (Church, InterestPoint, BookingListing):
+        pages = connection.iter_pages(cls, {"geohash": None}, columns=["id", "latitude", "longitude"], limit=CHUNK)
+        for items, cursor in pages:
+            connection.put_many(cls, [(item.id, {"geohash": spatial.encode(item.latitude, item.longitude)})
+                                      for item in items if item.latitude is not None and item.longitude is not None])
@@ -0,0 +1,7 @@
+-- The content columns hold zlib compressed bytes from now on, see database/types.py.
+-- MEDIUMTEXT to MEDIUMBLOB keeps the utf8 bytes of the existing rows, 0006_compress_content.py compresses them.
+
+ALTER TABLE interest_points_content MODIFY content MEDIUMBLOB;
+ALTER TABLE interest_points_facility MODIFY content MEDIUMBLOB;
+ALTER TABLE booking_listings_content MODIFY content MEDIUMBLOB;
+ALTER TABLE booking_listings_facility MODIFY content MEDIUMBLOB;
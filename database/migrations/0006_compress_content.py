@@ -0,0 +1,16 @@
+"""
+    Compress the content of the rows stored before 0005_compressed_content.sql. Reading goes through
+    CompressedText, which returns old and new rows alike, so running it again only recompresses the same values.
+"""
+from database.mappings import InterestPointContent, InterestPointFacility, BookingListingContent, \
+    BookingListingFacility
+
+CHUNK = 200
+
+
+def upgrade(connection):
+    for cls in (InterestPointContent, InterestPointFacility, BookingListingContent, BookingListingFacility):
+        for items, cursor in connection.iter_pages(cls, columns=["id", "content"], limit=CHUNK):
+            connection.put_many(cls, [(item.id, {"content": item.content}) for item in items])
+            # the compressed values are not needed anymore, keep the session small
+            connection.session.expunge_all()
@@ -0,0 +1,72 @@
+"""
+    In process trigram index used for fuzzy title and name lookups, instead of LIKE '%...%' table scans.
+"""
+from collections import Counter
+from slugify import slugify
+
+
+def trigrams(value):
+    """Set of the trigrams of a slugified string, padded so short words still produce some."""
+    words = slugify(value or "", separator=" ").split()
+    result = set()
+    for word in words:
+        padded = "  " + word + " "
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+class TrigramIndex:
+    """Fuzzy search over short strings, scored by the dice coefficient of their trigrams"""
+    def __init__(self, items=None):
+        self.postings = {}
+        self.values = {}
+        self.sizes = {}
+        for item_id, value in items or []:
+            self.add(item_id, value)
+
+    def __len__(self):
+        return len(self.values)
+
+    def add(self, item_id, value):
+        """Index a value, replacing the previous value of the same id."""
+        if item_id in self.values:
+            self.remove(item_id)
+        grams = trigrams(value)
+        if not grams:
+            return
+        self.values[item_id] = value
+        self.sizes[item_id] = len(grams)
+        for gram in grams:
+            self.postings.setdefault(gram, set()).add(item_id)
+
+    def remove(self, item_id):
+        """Drop an id from the index."""
+        value = self.values.pop(item_id, None)
+        self.sizes.pop(item_id, None)
+        for gram in trigrams(value):
+            self.postings.get(gram, set()).discard(item_id)
+
+    def search(self, query, limit=10, threshold=0.3, allowed=None):
+        """
+        Find the values closest to query.
+        :param query: string, searched text in any spelling
+        :param limit: int, maximum number of candidates
+        :param threshold: float, minimum score between 0 and 1
+        :param allowed: set, only ids from this set are returned
+        :return: list, (id, value, score) tuples with the best score first
+        """
+        grams = trigrams(query)
+        if not grams:
+            return []
+        hits = Counter()
+        for gram in grams:
+            hits.update(self.postings.get(gram, ()))
+        results = []
+        for item_id, common in hits.items():
+            if allowed is not None and item_id not in allowed:
+                continue
+            score = 2.0 * common / (len(grams) + self.sizes[item_id])
+            if score >= threshold:
+                results.append((item_id, self.values[item_id], score))
+        results.sort(key=lambda x: (-x[2], x[0]))
+        return results[:limit]
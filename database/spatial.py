@@ -0,0 +1,81 @@
+"""
+    Geohash cells and distances. The geohash column of the mapped tables holds the cell of the coordinates,
+    every cell is a prefix range of that column, so radius and nearest lookups are index range scans.
+"""
+from math import radians, sin, cos, asin, sqrt
+
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+PRECISION = 12
+EARTH_RADIUS = 6371000.0
+METERS_PER_DEGREE = 111320.0
+
+
+def encode(latitude, longitude, precision=PRECISION):
+    """Geohash of a point, None if a coordinate is missing."""
+    if latitude is None or longitude is None:
+        return None
+    latitude, longitude = float(latitude), float(longitude)
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    result, bits, value, even = [], 0, 0, True
+    while len(result) < precision:
+        interval, coordinate = (lon_range, longitude) if even else (lat_range, latitude)
+        middle = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            result.append(BASE32[value])
+            bits, value = 0, 0
+    return "".join(result)
+
+
+def cell_size(precision):
+    """Height and width in degrees of the cells of a precision."""
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def cell_meters(latitude, precision):
+    """Smallest side in meters of the cells of a precision, at a latitude."""
+    height, width = cell_size(precision)
+    return min(height * METERS_PER_DEGREE, width * METERS_PER_DEGREE * cos(radians(float(latitude))))
+
+
+def block(latitude, longitude, precision):
+    """Cell of a point and its eight neighbours. Everything closer than cell_meters is inside them."""
+    height, width = cell_size(precision)
+    cells = set()
+    for d_lat in (-height, 0, height):
+        for d_lon in (-width, 0, width):
+            lat = min(max(float(latitude) + d_lat, -90.0), 90.0)
+            lon = (float(longitude) + d_lon + 180.0) % 360.0 - 180.0
+            cells.add(encode(lat, lon, precision))
+    return sorted(cells)
+
+
+def precision_for(latitude, meters):
+    """Finest precision whose cells are at least meters wide, so a 3x3 block covers the radius."""
+    for precision in range(PRECISION, 0, -1):
+        if cell_meters(latitude, precision) >= meters:
+            return precision
+    return 1
+
+
+def distance(lat1, lon1, lat2, lon2):
+    """Great circle distance in meters."""
+    lat1, lon1, lat2, lon2 = map(radians, map(float, (lat1, lon1, lat2, lon2)))
+    a = sin((lat2 - lat1) / 2) ** 2 + cos(lat1) * cos(lat2) * sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * asin(sqrt(a))
+
+
+def with_geohash(cls, values):
+    """Add the geohash to column values of cls that set both coordinates."""
+    if "geohash" in cls.__table__.columns and "latitude" in values and "longitude" in values:
+        values["geohash"] = encode(values["latitude"], values["longitude"])
+    return values
@@ -0,0 +1,47 @@
+"""
+    Column types shared by the mappings.
+"""
+from zlib import compress, decompress
+from sqlalchemy.types import TypeDecorator, LargeBinary
+from sqlalchemy.dialects.mysql import MEDIUMBLOB
+
+# first byte of a stored value, tells how the rest of it is encoded
+ZLIB = b"\x01"
+
+
+def pack(value, level=6):
+    """Stored form of a str or utf8 bytes value."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = value.encode("utf8")
+    return ZLIB + compress(value, level)
+
+
+def unpack(value):
+    """str value of a stored one. Values written before the compression have no version byte and are kept."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return value
+    value = bytes(value)
+    if value[:1] == ZLIB:
+        value = decompress(value[1:])
+    return value.decode("utf8")
+
+
+class CompressedText(TypeDecorator):
+    """Text stored zlib compressed in a MEDIUMBLOB, written as str or utf8 bytes and read as str"""
+    impl = LargeBinary
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == "mysql":
+            return dialect.type_descriptor(MEDIUMBLOB())
+        return dialect.type_descriptor(LargeBinary())
+
+    def process_bind_param(self, value, dialect):
+        return pack(value)
+
+    def process_result_value(self, value, dialect):
+        return unpack(value)
@@ -1,8 +1,10 @@
 from database import connection
 from assets import access
+from scripts import client
 from scripts.manager import MapClient, ScrapeManager
 from scripts.wp_controller import WordPressManager
 from time import gmtime, strftime
+import atexit
 import logging
 
 logging_flag = False
@@ -25,7 +27,11 @@ if __name__ == '__main__':
                             datefmt="%H:%M:%S",
                             level=logging.DEBUG)
     maps = MapClient(access, timeout=5, queries_per_second=100, language='ro')
+    # pages fetched by earlier runs are answered from disk or revalidated with a conditional request
+    client.enable_cache(root_path + "\\_cache")
     session = connection.DataBaseView(access)
+    # the managers can stop the run with exit(), the query summary is printed however the run ends
+    atexit.register(lambda: print(session.stats.summary()))
 
     # manager = ScrapeManager(access, maps, session)
     # manager.fix_images(r"C:\Users\fabbs\Desktop\Churches", r"C:\Users\fabbs\Desktop\Test")
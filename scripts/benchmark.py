@@ -0,0 +1,53 @@
+"""
+    Pages per second of the WebPage parser backends on saved pages, e.g. biserici, booking and wiki pages.
+    Everything runs in one process, so the numbers are per core:
+        python -m scripts.benchmark <folder>
+    Every file under the folder is read as a page, the folder of the http cache works as well.
+"""
+import os
+import sys
+from time import perf_counter
+from scripts.scrape import WebPage
+
+CASES = [
+    ("full soup, lxml", {"parser": "lxml"}, lambda page: page.soup),
+    ("full soup, html.parser", {"parser": "html.parser"}, lambda page: page.soup),
+    ("links, full soup", {"parser": "lxml"}, WebPage.get_links),
+    ("links, only <a> soup", {"parser": "lxml", "parse_only": ["a"]}, WebPage.get_links),
+    ("links, lxml.html", {"parser": "lxml.html"}, WebPage.get_links),
+    ("table, full soup", {"parser": "lxml"}, lambda page: page.match_elements("table")),
+    ("table, only <table> soup", {"parser": "lxml", "parse_only": ["table"]},
+     lambda page: page.match_elements("table")),
+]
+
+
+def load_pages(folder):
+    """Content of every saved page under folder."""
+    pages = []
+    for root, dirs, files in os.walk(folder):
+        for name in files:
+            if name.endswith((".sqlite", ".tmp")):
+                continue
+            with open(os.path.join(root, name), "rb") as f:
+                pages.append(f.read())
+    return pages
+
+
+def run(folder, repeat=3):
+    """Print the pages parsed per second by every backend, the best of repeat runs."""
+    pages = load_pages(folder)
+    size = sum(len(x) for x in pages)
+    print("{} pages, {:.1f} MB".format(len(pages), size / 1e6))
+    for name, options, read in CASES:
+        best = None
+        for k in range(repeat):
+            start = perf_counter()
+            for content in pages:
+                read(WebPage.from_content("", 200, content, **options))
+            elapsed = perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print("{:<28} {:>9.1f} pages/s  {:>7.1f} MB/s".format(name, len(pages) / best, size / best / 1e6))
+
+
+if __name__ == '__main__':
+    run(sys.argv[1])
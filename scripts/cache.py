@@ -0,0 +1,142 @@
+import os
+import sqlite3
+from collections import namedtuple
+from hashlib import sha256
+from threading import Lock
+from time import time
+from uuid import uuid4
+from .util import canonical_url, mk_dir
+
+TTL = 7 * 86400
+MAX_BYTES = 2 * 1024 ** 3
+# the size is checked every EVICT_EVERY stored responses, it can exceed max_bytes a little in between
+EVICT_EVERY = 100
+
+CachedResponse = namedtuple("CachedResponse", ["status_code", "content", "headers", "from_cache"])
+
+
+class HttpCache:
+    """
+    Response bodies on disk, stored once per content hash and indexed by canonical url in a sqlite file.
+    Fresh entries are served without a request, stale ones are revalidated with their ETag and Last-Modified.
+    """
+    def __init__(self, directory=r"assets\http_cache", ttl=TTL, max_bytes=MAX_BYTES):
+        """
+        :param directory: string, folder of the index and the bodies
+        :param ttl: int, seconds an entry is served without asking the server
+        :param max_bytes: int, size of the stored bodies, the least recently used entries are evicted above it
+        """
+        self.directory = mk_dir(directory)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.lock = Lock()
+        self.stores = 0
+        self.db = sqlite3.connect(os.path.join(directory, "index.sqlite"), check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS entries (url TEXT PRIMARY KEY, body TEXT, size INTEGER, "
+                        "etag TEXT, last_modified TEXT, validated REAL, accessed REAL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS ix_entries_accessed ON entries (accessed)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS ix_entries_body ON entries (body)")
+        self.db.commit()
+
+    def path(self, body):
+        return os.path.join(self.directory, body[:2], body)
+
+    def lookup(self, url):
+        """Entry of a url as a dict, None if it isn't cached."""
+        with self.lock:
+            row = self.db.execute("SELECT body, size, etag, last_modified, validated FROM entries WHERE url = ?",
+                                  (canonical_url(url),)).fetchone()
+        if row is None or not os.path.isfile(self.path(row[0])):
+            return None
+        return {"body": row[0], "size": row[1], "etag": row[2], "last_modified": row[3], "validated": row[4]}
+
+    def is_fresh(self, entry):
+        return entry is not None and entry["validated"] + self.ttl > time()
+
+    @staticmethod
+    def conditional_headers(entry):
+        """Headers asking the server to answer 304 if the cached body is still current."""
+        headers = {}
+        if entry is not None:
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def read(self, url, entry):
+        """Cached body of an entry, marked as recently used."""
+        with open(self.path(entry["body"]), "rb") as f:
+            content = f.read()
+        with self.lock:
+            self.db.execute("UPDATE entries SET accessed = ? WHERE url = ?", (time(), canonical_url(url)))
+            self.db.commit()
+        return content
+
+    def cached(self, url, entry):
+        """Response of a fresh entry."""
+        return CachedResponse(200, self.read(url, entry), {}, True)
+
+    def resolve(self, url, entry, status_code, headers, content):
+        """
+        Response to hand to the caller for a server answer: the cached body on a 304, the new body otherwise.
+        200 responses are stored.
+        """
+        if status_code == 304 and entry is not None:
+            with self.lock:
+                self.db.execute("UPDATE entries SET validated = ? WHERE url = ?", (time(), canonical_url(url)))
+                self.db.commit()
+            return CachedResponse(200, self.read(url, entry), headers, True)
+        if status_code == 200 and content is not None:
+            self.store(url, content, headers)
+        return CachedResponse(status_code, content, headers, False)
+
+    def store(self, url, content, headers):
+        body = sha256(content).hexdigest()
+        path = self.path(body)
+        if not os.path.isfile(path):
+            mk_dir(os.path.dirname(path))
+            # written under a temporary name, a crash never leaves a truncated body behind
+            temp_path = "{}.{}.tmp".format(path, uuid4().hex)
+            with open(temp_path, "wb") as f:
+                f.write(content)
+            os.replace(temp_path, path)
+        now = time()
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            (canonical_url(url), body, len(content), headers.get("ETag"),
+                             headers.get("Last-Modified"), now, now))
+            self.db.commit()
+            self.stores += 1
+            evict = self.stores % EVICT_EVERY == 0
+        if evict:
+            self.evict()
+
+    def size(self):
+        """Bytes of the stored bodies, each body counted once."""
+        with self.lock:
+            return self.db.execute("SELECT COALESCE(SUM(size), 0) FROM (SELECT DISTINCT body, size FROM entries)"
+                                   ).fetchone()[0]
+
+    def evict(self, target=0.9):
+        """Once max_bytes is exceeded, drop the least recently used entries down to target of max_bytes."""
+        size = self.size()
+        if size <= self.max_bytes:
+            return
+        excess = size - self.max_bytes * target
+        with self.lock:
+            rows = self.db.execute("SELECT url, body, size FROM entries ORDER BY accessed").fetchall()
+            removed = []
+            for url, body, size in rows:
+                if excess <= 0:
+                    break
+                self.db.execute("DELETE FROM entries WHERE url = ?", (url,))
+                if self.db.execute("SELECT 1 FROM entries WHERE body = ? LIMIT 1", (body,)).fetchone() is None:
+                    removed.append(body)
+                    excess -= size
+            self.db.commit()
+        for body in removed:
+            try:
+                os.remove(self.path(body))
+            except FileNotFoundError:
+                pass
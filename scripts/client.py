@@ -0,0 +1,144 @@
+import requests
+from random import choice
+from threading import Lock
+from time import perf_counter
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError as RequestConnectionError, Timeout as RequestTimeout
+from urllib3 import Timeout
+from .cache import HttpCache
+from .ratelimit import limiter
+
+try:
+    from fake_useragent import UserAgent
+except ImportError:
+    UserAgent = None
+
+# one session for the whole process, its pools keep the connections to every host alive between requests
+POOL_HOSTS = 50
+POOL_SIZE = 20
+USER_AGENTS = 20
+THROTTLE_RETRIES = 3
+PROXY_RETRIES = 5
+FALLBACK_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) " \
+                      "Chrome/74.0.3729.169 Safari/537.36"
+
+_session = None
+_cache = None
+_user_agents = []
+_lock = Lock()
+
+
+def new_session(pool_hosts=POOL_HOSTS, pool_size=POOL_SIZE):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_hosts, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def configure(pool_hosts=POOL_HOSTS, pool_size=POOL_SIZE):
+    """
+    Replace the shared session with one of a different size.
+    :param pool_hosts: int, number of hosts whose connections are kept open
+    :param pool_size: int, connections kept open per host, at least the number of parallel workers per host
+    """
+    global _session
+    with _lock:
+        previous, _session = _session, new_session(pool_hosts, pool_size)
+    if previous is not None:
+        previous.close()
+    return _session
+
+
+def session():
+    """Shared session, created on first use."""
+    global _session
+    with _lock:
+        if _session is None:
+            _session = new_session()
+        return _session
+
+
+def enable_cache(*args, **kwargs):
+    """Answer fetch() from an HttpCache, created with the given arguments."""
+    global _cache
+    _cache = HttpCache(*args, **kwargs)
+    return _cache
+
+
+def cache():
+    """The HttpCache of fetch(), None while caching is disabled."""
+    return _cache
+
+
+def user_agent():
+    """Random chrome user agent, from a list drawn once instead of loading fake_useragent per request."""
+    if not _user_agents:
+        # no lock held while fake_useragent loads its data, greenlets waiting on it would block the whole thread
+        drawn = [FALLBACK_USER_AGENT]
+        if UserAgent is not None:
+            try:
+                agents = UserAgent()
+                drawn = list(set(agents.chrome for i in range(USER_AGENTS)))
+            except Exception as e:
+                print("User agents unavailable : {}".format(e))
+        with _lock:
+            if not _user_agents:
+                _user_agents.extend(drawn)
+    return choice(_user_agents)
+
+
+def get(url, proxy_list=None, headers=None, timeout=Timeout(connect=5, read=20), **kwargs):
+    """
+    GET through the shared session, with a rotated user agent, at the rate the limiter allows for the host.
+    Responses with a 429 or 503 stop the host for their Retry-After time and are retried.
+    :param url: string
+    :param proxy_list: ProxyList, the request goes through one of its proxies, retried on others on failure
+    :param headers: dict, extra headers
+    :param timeout: urllib3 Timeout or seconds
+    :param kwargs: other requests arguments, e.g. stream=True
+    """
+    request_headers = {"user-agent": user_agent()}
+    request_headers.update(headers or {})
+    key = limiter.key(url)
+    for attempt in range(THROTTLE_RETRIES + 1):
+        limiter.acquire(key)
+        response = request(url, proxy_list, request_headers, timeout, **kwargs)
+        if attempt == THROTTLE_RETRIES or not limiter.throttled(key, response.status_code, response.headers):
+            return response
+        response.close()
+
+
+def request(url, proxy_list, headers, timeout, **kwargs):
+    """GET, through up to PROXY_RETRIES proxies of proxy_list, each outcome is reported to the pool."""
+    if proxy_list is None:
+        return session().get(url, headers=headers, timeout=timeout, **kwargs)
+    error = None
+    for attempt in range(PROXY_RETRIES):
+        proxy_host = proxy_list.random()
+        start = perf_counter()
+        try:
+            response = session().get(url, headers=headers, proxies={"http": proxy_host, "https": proxy_host},
+                                     timeout=timeout, **kwargs)
+        except (RequestConnectionError, RequestTimeout) as e:
+            proxy_list.report(proxy_host, False)
+            error = e
+            continue
+        proxy_list.report(proxy_host, True, perf_counter() - start)
+        return response
+    raise error
+
+
+def fetch(url, proxy_list=None, timeout=Timeout(connect=5, read=20)):
+    """
+    GET of a whole body through the http cache, when enable_cache was called. Fresh entries are answered
+    from disk, stale ones are revalidated with a conditional request.
+    :return: object with status_code, content and headers, a requests response or a CachedResponse
+    """
+    if _cache is None:
+        return get(url, proxy_list, timeout=timeout)
+    entry = _cache.lookup(url)
+    if _cache.is_fresh(entry):
+        return _cache.cached(url, entry)
+    response = get(url, proxy_list, _cache.conditional_headers(entry), timeout)
+    return _cache.resolve(url, entry, response.status_code, response.headers, response.content)
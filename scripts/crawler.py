@@ -1,5 +1,6 @@
 from .scrape import WebPage, ProxyList
-from urllib.parse import urlparse
+from urllib.parse import urljoin, urlparse
+from .frontier import Frontier
 import re
 try:
     import sys
@@ -18,7 +19,11 @@ else:
 
 class Crawler:
     """Crawl url and generate sitemap"""
-    def __init__(self, url, outputfile="output.xml", logfile="error.log", oformat="xml", echo=True):
+    def __init__(self, url, outputfile="output.xml", logfile="error.log", oformat="xml", echo=True,
+                 checkpoint=None):
+        """
+        :param checkpoint: string, sqlite file of the crawl state, default crawls\\<host>.sqlite
+        """
         self.url = url
         self.logfile = open(logfile, "a")
         self.oformat = oformat
@@ -27,10 +32,11 @@ class Crawler:
         self.echo = echo
         self.regex = None
 
-        # create lists for the urls in que and visited urls
         self.proxy_list = ProxyList()
-        self.urls = set([url])
-        self.visited = set()
+        self.proxy_list.start_revalidation()
+        # queued and parsed urls are kept on disk, an interrupted crawl resumes where it stopped
+        self.frontier = Frontier(checkpoint or "crawls\\" + urlparse(url).hostname + ".sqlite")
+        self.frontier.push(url)
         self.exts = ["htm", "php"]
         self.allowed_regex = "\.((?!htm)(?!php)\w+)$"
 
@@ -53,8 +59,11 @@ class Crawler:
             self.pool.spawn(self.parse_gevent)
             self.pool.join()
         else:
-            while len(self.urls) > 0:
+            while len(self.frontier) > 0:
                 self.parse()
+        self.frontier.checkpoint()
+        self.proxy_list.stop_revalidation()
+        self.proxy_list.save()
         if self.oformat == 'xml':
             self.write_xml()
         elif self.oformat == 'txt':
@@ -62,36 +71,37 @@ class Crawler:
 
     def parse_gevent(self):
         self.parse()
-        while len(self.urls) > 0 and not self.pool.full():
+        while len(self.frontier) > 0 and not self.pool.full():
             self.pool.spawn(self.parse_gevent)
 
     def parse(self):
         if self.echo:
             if not gevent_installed:
-                print("{} pages parsed :: {} pages in the queue".format(len(self.visited), len(self.urls)))
+                print("{} pages parsed :: {} pages in the queue".format(self.frontier.parsed, len(self.frontier)))
             else:
-                print("{} pages parsed :: {} parsing processes :: {} pages in the queue".format(len(self.visited),
+                print("{} pages parsed :: {} parsing processes :: {} pages in the queue".format(self.frontier.parsed,
                                                                                                 len(self.pool),
-                                                                                                len(self.urls)))
+                                                                                                len(self.frontier)))
         # Set the starting point for the spider
-        if not len(self.urls):
+        item = self.frontier.pop()
+        if item is None:
             return
-        else:
-            url = self.urls.pop()
-            if url in self.visited:
+        url, depth = item
+        try:
+            # only the links are read, no soup is built
+            response = WebPage(url, self.proxy_list, parser="lxml.html", parse_only=["a"])
+            if response.status_code > 301:
+                self.errlog("Error {} at url {}".format(response.status_code, url))
                 return
-            try:
-                response = WebPage(url, self.proxy_list)
-                if response.status_code > 301:
-                    self.errlog("Error {} at url {}".format(response.status_code, url))
-                    return
-                for link in [x.replace("../", self.url) for x in response.get_links()]:
-                    if self.is_valid(link):
-                        self.urls.update([link])
-            except Exception as e:
-                self.errlog(str(e))
-            finally:
-                self.visited.update([url])
+            for link in response.get_links():
+                # relative links are resolved against the page, the frontier keeps their canonical form
+                link = urljoin(url, link)
+                if self.is_valid(link):
+                    self.frontier.push(link, depth + 1)
+        except Exception as e:
+            self.errlog(str(e))
+        finally:
+            self.frontier.done(url)
 
     def is_valid(self, url):
         parsed_url = urlparse(url)
@@ -110,23 +120,23 @@ class Crawler:
         self.logfile.write("\n")
 
     def write_xml(self):
-        of = open(self.outputfile, "w")
+        of = open(self.outputfile, "w", encoding="utf-8")
         of.write("<?xml version=\"1.0\" encoding=\"utf-8\"?>\n")
         of.write("<urlset xmlns=\"http://www.sitemaps.org/schemas/sitemap/0.9\""
                  " xmlns:xsi=\"http://www.w3.org/2001/XMLSchema-instance\""
                  " xsi:schemaLocation=\"http://www.sitemaps.org/schemas/sitemap/0.9"
                  " http://www.sitemaps.org/schemas/sitemap/0.9/sitemap.xsd\">\n")
         url_str = "<url><loc>{}</loc></url>\n"
-        while len(self.visited):
-            of.write(url_str.format(self.visited.pop().encode("utf-8")))
+        for url in self.frontier.visited():
+            of.write(url_str.format(url))
 
         of.write("</urlset>")
         of.close()
 
     def write_txt(self):
-        of = open(self.outputfile, "w")
+        of = open(self.outputfile, "w", encoding="utf-8")
         url_str = "{}\n"
-        while len(self.visited):
-            of.write(url_str.format(self.visited.pop()))
+        for url in self.frontier.visited():
+            of.write(url_str.format(url))
 
         of.close()
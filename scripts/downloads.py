@@ -0,0 +1,211 @@
+import os
+import re
+import shutil
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from hashlib import sha256
+from threading import BoundedSemaphore, Lock
+from uuid import uuid4
+from urllib3 import Timeout
+from . import client
+from .ratelimit import limiter
+from .util import canonical_url, mk_dir
+
+WORKERS = 16
+PER_HOST = 4
+# bytes read from the socket at once and bytes buffered before a write to disk
+CHUNK_SIZE = 256 * 1024
+BUFFER_SIZE = 1024 * 1024
+# a url is downloaded by one worker at a time, urls are spread over this many locks
+LOCK_STRIPES = 256
+CONTENT_RANGE = re.compile(r"bytes (\d+)-")
+
+
+class ImageDownloader:
+    """
+    Concurrent image downloads into a store where every distinct image is kept once, named by its content hash.
+    The requested paths are hard links to the stored files, interrupted downloads are resumed with a Range request
+    that only applies while the image is unchanged, If-Range with the ETag or Last-Modified of the first response.
+    """
+    def __init__(self, directory=r"assets\images", proxy_list=None, workers=WORKERS, per_host=PER_HOST,
+                 timeout=Timeout(connect=5, read=20)):
+        """
+        :param directory: string, folder of the stored images, on the same drive as the requested paths
+        :param proxy_list: ProxyList, every download goes through one of its proxies
+        :param workers: int, downloads running at once
+        :param per_host: int, downloads running at once from the same host
+        :param timeout: urllib3 Timeout
+        """
+        self.directory = mk_dir(directory)
+        self.proxy_list = proxy_list
+        self.per_host = per_host
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(workers)
+        self.hosts = {}
+        self.stripes = [Lock() for i in range(LOCK_STRIPES)]
+        self.lock = Lock()
+        self.db = sqlite3.connect(os.path.join(directory, "index.sqlite"), check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS images (url TEXT PRIMARY KEY, body TEXT)")
+        self.db.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """Wait for the submitted downloads."""
+        self.executor.shutdown()
+
+    def path(self, body):
+        return os.path.join(self.directory, body[:2], body)
+
+    def part_path(self, url):
+        """Partial file of a url, kept between runs so that the download can be resumed."""
+        return os.path.join(self.directory, "parts", sha256(canonical_url(url).encode()).hexdigest() + ".part")
+
+    def stored(self, url):
+        """Stored file of an already downloaded url, None if it wasn't downloaded."""
+        with self.lock:
+            row = self.db.execute("SELECT body FROM images WHERE url = ?", (canonical_url(url),)).fetchone()
+        if row is None or not os.path.isfile(self.path(row[0])):
+            return None
+        return self.path(row[0])
+
+    def host_slot(self, url):
+        """Semaphore limiting the downloads running at once from the host of a url."""
+        key = limiter.key(url)
+        with self.lock:
+            if key not in self.hosts:
+                self.hosts[key] = BoundedSemaphore(self.per_host)
+            return self.hosts[key]
+
+    def submit(self, url, file_path):
+        """Download an image in the background, returns a Future of download."""
+        return self.executor.submit(self.download, url, file_path)
+
+    def download_many(self, images):
+        """
+        Download images concurrently.
+        :param images: iterable of (url, file path) tuples
+        :return: generator of (url, file path, result of download) tuples in the order they complete
+        """
+        futures = {self.submit(url, file_path): (url, file_path) for url, file_path in images}
+        for future in as_completed(futures):
+            yield futures[future] + (future.result(),)
+
+    def download(self, url, file_path):
+        """
+        Download one image to file_path, an existing file_path is kept.
+        :return: file_path, None if the download failed
+        """
+        if os.path.isfile(file_path):
+            return file_path
+        try:
+            with self.stripes[hash(canonical_url(url)) % LOCK_STRIPES]:
+                stored = self.stored(url)
+                if stored is None:
+                    with self.host_slot(url):
+                        stored = self.fetch(url)
+            if stored is None:
+                return None
+            self.link(stored, file_path)
+        except Exception as e:
+            print("Error on image {} : {}".format(url, e))
+            return None
+        return file_path
+
+    def fetch(self, url):
+        """Download url into the store, resuming its partial file. Returns the stored path, None on failure."""
+        part = self.part_path(url)
+        mk_dir(os.path.dirname(part))
+        for attempt in range(3):
+            # a partial file is only resumed with the validator of the response it came from
+            validator = self.read_validator(part)
+            offset = os.path.getsize(part) if validator is not None and os.path.isfile(part) else 0
+            headers = {"Range": "bytes={}-".format(offset), "If-Range": validator} if offset else None
+            response = client.get(url, self.proxy_list, headers, self.timeout, stream=True)
+            try:
+                if response.status_code not in (200, 206, 416):
+                    print("Error {} on image {}".format(response.status_code, url))
+                    return None
+                append = False
+                if response.status_code == 206:
+                    match = CONTENT_RANGE.match(response.headers.get("Content-Range", ""))
+                    current = self.validator(response.headers)
+                    append = offset and match is not None and int(match.group(1)) == offset and \
+                        current in (None, validator)
+                if response.status_code == 416 or (response.status_code == 206 and not append):
+                    # the partial file doesn't belong to the image on the server anymore, it is downloaded again
+                    self.discard(part)
+                    continue
+                digest = sha256()
+                if append:
+                    with open(part, "rb") as f:
+                        for block in iter(lambda: f.read(BUFFER_SIZE), b""):
+                            digest.update(block)
+                else:
+                    self.write_validator(part, self.validator(response.headers))
+                with open(part, "ab" if append else "wb", buffering=BUFFER_SIZE) as f:
+                    for block in response.iter_content(CHUNK_SIZE):
+                        f.write(block)
+                        digest.update(block)
+            finally:
+                response.close()
+            return self.store(url, part, digest.hexdigest())
+        return None
+
+    @staticmethod
+    def validator(headers):
+        """If-Range value of a response, its strong ETag or else its Last-Modified date, None if it has neither."""
+        etag = headers.get("ETag")
+        if etag and not etag.startswith("W/"):
+            return etag
+        return headers.get("Last-Modified")
+
+    @staticmethod
+    def read_validator(part):
+        try:
+            with open(part + ".validator", "r") as f:
+                return f.read() or None
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def write_validator(part, validator):
+        with open(part + ".validator", "w") as f:
+            f.write(validator or "")
+
+    @staticmethod
+    def discard(part):
+        """Remove a partial file and its validator."""
+        for path in (part, part + ".validator"):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def store(self, url, part, body):
+        """Move a complete download to the store, dropped if the same image is already stored."""
+        path = self.path(body)
+        if os.path.isfile(path):
+            os.remove(part)
+        else:
+            mk_dir(os.path.dirname(path))
+            os.replace(part, path)
+        self.discard(part)
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO images VALUES (?, ?)", (canonical_url(url), body))
+            self.db.commit()
+        return path
+
+    @staticmethod
+    def link(stored, file_path):
+        """Hard link file_path to a stored image, copied where links aren't supported, e.g. across drives."""
+        temp_path = "{}.{}.tmp".format(file_path, uuid4().hex)
+        try:
+            os.link(stored, temp_path)
+        except OSError:
+            shutil.copyfile(stored, temp_path)
+        os.replace(temp_path, file_path)
@@ -0,0 +1,121 @@
+"""
+    Extraction stage, the parsing of fetched pages runs in a pool of processes instead of the fetching thread.
+    Only the raw bytes of a response go to a worker, what comes back is the plain result of the parse method.
+        with Extractor() as extractor:
+            for url, status_code, details in extractor.extract_many("booking", listing_urls):
+                ...
+"""
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from . import fetch
+from .scrape import ListingPage, WebPage, WikiPage
+
+# page class and parse method of every kind of page, looked up by name so that only strings and bytes are pickled
+EXTRACTORS = {
+    "booking": (ListingPage, ListingPage.parse_listing),
+    "content": (WebPage, WebPage.page_content),
+    "table": (WebPage, WebPage.reflect_table),
+    "wiki": (WikiPage, WikiPage.wiki_page),
+}
+# pages waiting in the pool per worker, the fetches pause above it instead of piling bodies up in memory
+BACKLOG = 4
+POLL_INTERVAL = 0.01
+
+
+def extract(kind, url, content, args=()):
+    """Runs in a worker process, rebuild the page of a response and parse it."""
+    page_class, parse = EXTRACTORS[kind]
+    return parse(page_class.from_content(url, 200, content), *args)
+
+
+class Extractor:
+    """Pool of parser processes, one per core by default"""
+    def __init__(self, workers=None, backlog=BACKLOG):
+        """
+        :param workers: int, parser processes, default the number of cores
+        :param backlog: int, pages waiting in the pool per worker
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.backlog = backlog
+        # spawned, not forked: a forked worker inherits the gevent hub of the monkey patched scrapers and the pool
+        # can't be shut down, spawn is also the only start method on windows
+        self.executor = ProcessPoolExecutor(self.workers, mp_context=get_context("spawn"))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown()
+
+    def submit(self, kind, url, content, *args):
+        """
+        Parse one page in the pool.
+        :param kind: string, key of EXTRACTORS
+        :param url: string
+        :param content: bytes, body of the response
+        :param args: arguments of the parse method, e.g. attributes_returned of reflect_table
+        :return: Future of the parse result
+        """
+        return self.executor.submit(extract, kind, url, content, args)
+
+    @staticmethod
+    def result(url, future):
+        try:
+            return future.result()
+        except Exception as e:
+            print("Extraction of {} failed : {}".format(url, e))
+            return None
+
+    def completed(self, pending, block):
+        """Pop the finished jobs of pending, waiting for at least one if block."""
+        # polled instead of concurrent.futures.wait: in the monkey patched scrapers the results are handed over by
+        # a greenlet, it only runs while this one sleeps, and wait can block on an unpatched lock
+        while block and not any(x.done() for x in pending):
+            time.sleep(POLL_INTERVAL)
+        done = [x for x in pending if x.done()]
+        for future in done:
+            url, status_code = pending.pop(future)
+            yield url, status_code, self.result(url, future)
+
+    def map(self, kind, pages, *args):
+        """
+        Parse already fetched pages, results are yielded as they complete, not in the order of pages.
+        :param kind: string, key of EXTRACTORS
+        :param pages: iterable of (url, content) tuples, read lazily
+        :param args: arguments of the parse method
+        :return: generator of (url, result) tuples, result is None if the parsing failed
+        """
+        pending = {}
+        for url, content in pages:
+            pending[self.submit(kind, url, content, *args)] = (url, 200)
+            block = len(pending) >= self.workers * self.backlog
+            for url, status_code, result in self.completed(pending, block):
+                yield url, result
+        while pending:
+            for url, status_code, result in self.completed(pending, True):
+                yield url, result
+
+    def extract_many(self, kind, urls, proxylist=None, *args, concurrency=fetch.CONCURRENCY, per_host=fetch.PER_HOST):
+        """
+        Fetch urls concurrently and parse each page in the pool while the next ones download.
+        :param kind: string, key of EXTRACTORS
+        :param urls: iterable of urls
+        :param proxylist: ProxyList
+        :param args: arguments of the parse method
+        :return: generator of (url, status code, result) tuples in the order they complete, result is None for
+                 pages that couldn't be fetched or parsed
+        """
+        pending = {}
+        for url, status_code, body in fetch.fetch_many(urls, proxylist, concurrency, per_host):
+            if status_code != 200:
+                yield url, status_code, None
+                continue
+            pending[self.submit(kind, url, body, *args)] = (url, status_code)
+            yield from self.completed(pending, len(pending) >= self.workers * self.backlog)
+        while pending:
+            yield from self.completed(pending, True)
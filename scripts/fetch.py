@@ -0,0 +1,112 @@
+import asyncio
+from time import perf_counter
+from . import client
+from .ratelimit import limiter
+
+try:
+    import aiohttp
+except ImportError:
+    print("Aiohttp is not installed. Pages will be fetched one at a time.")
+    aiohttp = None
+
+CONCURRENCY = 50
+PER_HOST = 8
+RETRIES = 3
+
+
+async def fetch(session, url, proxy_list=None, retries=RETRIES):
+    """
+    GET one url, through the http cache of the client when it is enabled.
+    Returns (url, status code, body), or (url, None, error) if every attempt failed.
+    """
+    cache = client.cache()
+    entry = cache.lookup(url) if cache is not None else None
+    if entry is not None and cache.is_fresh(entry):
+        return url, 200, cache.cached(url, entry).content
+    headers = {"user-agent": client.user_agent()}
+    headers.update(cache.conditional_headers(entry) if cache is not None else {})
+    error = None
+    key = limiter.key(url)
+    attempt = throttled = 0
+    while attempt < (retries if proxy_list is not None else 1):
+        proxy = proxy_list.random() if proxy_list is not None else None
+        await limiter.acquire_async(key)
+        start = perf_counter()
+        try:
+            async with session.get(url, proxy=proxy, headers=headers) as response:
+                if proxy is not None:
+                    proxy_list.report(proxy, True, perf_counter() - start)
+                if throttled < client.THROTTLE_RETRIES and limiter.throttled(key, response.status, response.headers):
+                    throttled += 1
+                    continue
+                content = await response.read()
+                if cache is not None:
+                    return (url,) + tuple(cache.resolve(url, entry, response.status, response.headers, content)[:2])
+                return url, response.status, content
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            # a dead proxy, the next attempt goes through another one
+            if proxy is not None:
+                proxy_list.report(proxy, False)
+            error = e
+        attempt += 1
+    return url, None, error
+
+
+async def fetch_stream(urls, proxy_list=None, concurrency=CONCURRENCY, per_host=PER_HOST, connect_timeout=5,
+                       read_timeout=20):
+    """
+    Fetch urls concurrently and yield (url, status code, body) tuples in the order they complete.
+    :param urls: iterable of urls, read lazily, only concurrency of them are in flight at once
+    :param proxy_list: ProxyList, every request goes through one of its http proxies
+    :param concurrency: int, requests in flight at once
+    :param per_host: int, requests in flight at once to the same host
+    :param connect_timeout: float, seconds
+    :param read_timeout: float, seconds between two reads of the response
+    """
+    connector = aiohttp.TCPConnector(limit=concurrency, limit_per_host=per_host)
+    timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+    urls = iter(urls)
+    pending = set()
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        try:
+            while True:
+                for url in urls:
+                    pending.add(asyncio.ensure_future(fetch(session, url, proxy_list)))
+                    if len(pending) >= concurrency:
+                        break
+                if not pending:
+                    break
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+
+def fetch_many(urls, proxy_list=None, concurrency=CONCURRENCY, per_host=PER_HOST, connect_timeout=5,
+               read_timeout=20):
+    """
+    Blocking version of fetch_stream for the synchronous scrapers. The requests make progress while the
+    caller waits for the next result. Without aiohttp the urls are fetched one at a time with the shared client.
+    """
+    if aiohttp is None:
+        for url in urls:
+            try:
+                response = client.fetch(url, proxy_list, timeout=(connect_timeout, read_timeout))
+                yield url, response.status_code, response.content
+            except Exception as e:
+                yield url, None, e
+        return
+    loop = asyncio.new_event_loop()
+    stream = fetch_stream(urls, proxy_list, concurrency, per_host, connect_timeout, read_timeout)
+    try:
+        while True:
+            try:
+                result = loop.run_until_complete(stream.__anext__())
+            except StopAsyncIteration:
+                break
+            yield result
+    finally:
+        loop.run_until_complete(stream.aclose())
+        loop.close()
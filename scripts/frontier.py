@@ -0,0 +1,142 @@
+import os
+import sqlite3
+from hashlib import blake2b
+from math import ceil, log
+from threading import Lock
+from urllib.parse import urlsplit
+from .util import canonical_url, mk_dir
+
+# urls a crawl is expected to see and the share of new urls taken for seen ones once that many were added
+CAPACITY = 5 * 10 ** 6
+ERROR_RATE = 0.001
+# pages parsed between two checkpoints, a crash loses at most the work since the last one
+CHECKPOINT_EVERY = 500
+QUEUED, TAKEN, DONE = 0, 1, 2
+
+
+class BloomFilter:
+    """Fixed size set of fingerprints, it can answer that a new key was seen but never the opposite"""
+    def __init__(self, capacity=CAPACITY, error_rate=ERROR_RATE, bits=None):
+        """
+        :param capacity: int, keys added before the error rate is exceeded
+        :param error_rate: float, share of new keys reported as seen at capacity
+        :param bits: bytes, saved state of a filter of the same capacity and error rate
+        """
+        size = ceil(-capacity * log(error_rate) / log(2) ** 2)
+        self.hashes = max(1, round(size / capacity * log(2)))
+        self.size = size
+        if bits is not None and len(bits) == (size + 7) // 8:
+            self.bits = bytearray(bits)
+        else:
+            self.bits = bytearray((size + 7) // 8)
+
+    def positions(self, key):
+        digest = blake2b(key.encode("utf8"), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def __contains__(self, key):
+        return all(self.bits[x >> 3] & (1 << (x & 7)) for x in self.positions(key))
+
+    def add(self, key):
+        """Add a key, returns False if it was already seen."""
+        new = False
+        for x in self.positions(key):
+            if not self.bits[x >> 3] & (1 << (x & 7)):
+                self.bits[x >> 3] |= 1 << (x & 7)
+                new = True
+        return new
+
+
+class Frontier:
+    """
+    Urls of a crawl in a sqlite file, the next page is the least deep one, taking turns between hosts.
+    Seen urls are kept in a BloomFilter, saved in the same file at every checkpoint, so a crawl can resume.
+    """
+    def __init__(self, file, capacity=CAPACITY, error_rate=ERROR_RATE, checkpoint_every=CHECKPOINT_EVERY):
+        """
+        :param file: string, sqlite file of the crawl, an existing one is resumed
+        :param capacity: int, urls the crawl is expected to see
+        :param error_rate: float, share of new urls skipped as already seen once capacity is reached
+        :param checkpoint_every: int, pages parsed between two checkpoints
+        """
+        mk_dir(os.path.dirname(file))
+        self.checkpoint_every = checkpoint_every
+        self.lock = Lock()
+        self.db = sqlite3.connect(file, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS urls (id INTEGER PRIMARY KEY, url TEXT, depth INTEGER, "
+                        "host TEXT, rank INTEGER, state INTEGER)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS ix_urls_next ON urls (state, depth, rank, id)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS seen (id INTEGER PRIMARY KEY, bits BLOB)")
+        # pages taken by a worker that died with the process are queued again
+        self.db.execute("UPDATE urls SET state = ? WHERE state = ?", (QUEUED, TAKEN))
+        self.db.commit()
+        row = self.db.execute("SELECT bits FROM seen WHERE id = 1").fetchone()
+        self.seen = BloomFilter(capacity, error_rate, row[0] if row is not None else None)
+        self.ranks = dict(self.db.execute("SELECT host, MAX(rank) + 1 FROM urls GROUP BY host").fetchall())
+        self.queued = self.count(QUEUED)
+        self.parsed = self.count(DONE)
+        self.taken = {}
+        self.changes = 0
+
+    def __len__(self):
+        """Urls waiting in the queue."""
+        return self.queued
+
+    def count(self, state):
+        return self.db.execute("SELECT COUNT(*) FROM urls WHERE state = ?", (state,)).fetchone()[0]
+
+    def push(self, url, depth=0):
+        """
+        Queue a url unless it was seen before, in its canonical form.
+        :return: bool, True if the url was queued
+        """
+        url = canonical_url(url)
+        with self.lock:
+            if not self.seen.add(url):
+                return False
+            host = urlsplit(url).hostname
+            rank = self.ranks.get(host, 0)
+            self.ranks[host] = rank + 1
+            self.db.execute("INSERT INTO urls (url, depth, host, rank, state) VALUES (?, ?, ?, ?, ?)",
+                            (url, depth, host, rank, QUEUED))
+            self.queued += 1
+        return True
+
+    def pop(self):
+        """Next url to parse as (url, depth), None if the queue is empty."""
+        with self.lock:
+            row = self.db.execute("SELECT id, url, depth FROM urls WHERE state = ? ORDER BY depth, rank, id LIMIT 1",
+                                  (QUEUED,)).fetchone()
+            if row is None:
+                return None
+            self.db.execute("UPDATE urls SET state = ? WHERE id = ?", (TAKEN, row[0]))
+            self.taken[row[1]] = row[0]
+            self.queued -= 1
+        return row[1], row[2]
+
+    def done(self, url):
+        """Mark a popped url as parsed, checkpoints every checkpoint_every pages."""
+        with self.lock:
+            self.db.execute("UPDATE urls SET state = ? WHERE id = ?", (DONE, self.taken.pop(url)))
+            self.parsed += 1
+            self.changes += 1
+            checkpoint = self.changes >= self.checkpoint_every
+        if checkpoint:
+            self.checkpoint()
+
+    def checkpoint(self):
+        """Save the queue and the seen urls together, the crawl resumes from here after a crash."""
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO seen VALUES (1, ?)", (bytes(self.seen.bits),))
+            self.db.commit()
+            self.changes = 0
+
+    def visited(self):
+        """Parsed urls, in the order they were queued."""
+        for row in self.db.execute("SELECT url FROM urls WHERE state = ? ORDER BY id", (DONE,)):
+            yield row[0]
+
+    def close(self):
+        self.checkpoint()
+        self.db.close()
@@ -1,20 +1,22 @@
 import googlemaps
 import datetime
 import errno
-from random import randint
-from unidecode import unidecode
 from json import dumps, loads
 from math import floor
 from re import compile
 from time import sleep, time
 from slugify import slugify
-from .scrape import ProxyList, WebPage, download_file
+from .scrape import ProxyList, WebPage
+from .downloads import ImageDownloader
+from .ratelimit import limiter
 from .util import hash_factors, mk_dir
 from os import listdir, makedirs
 from os.path import basename, splitext, isfile, join, exists, dirname
 from database.mappings import *
+from database.gazetteer import Gazetteer
 from scripts.exceptions import *
 from urllib.parse import urlsplit, parse_qs
+from concurrent.futures import wait
 from math import ceil
 from PIL import Image
 
@@ -52,7 +54,7 @@ class MapClient:
             return None
         if not self.client:
             raise ResourceError("Error, no client found.")
-        sleep(2)
+        limiter.acquire(MAPS_API)
         results = {}
         try:
             results = self.client.places(**params)
@@ -68,6 +70,8 @@ class MapClient:
                 all_data.extend(data["results"])
             if data["next_page_token"]:
                 params["page_token"] = data["next_page_token"]
+                # google only accepts a page token a moment after returning it
+                sleep(PAGE_TOKEN_DELAY)
             data = self.perform_request(params)
         return all_data
 
@@ -93,22 +97,26 @@ class MapClient:
     def find_location(self, lat, long):
         if not self.client:
             raise ResourceError("Error, no client found.")
+        limiter.acquire(MAPS_API)
         return self.client.reverse_geocode((lat, long), language='ro')
 
     def find_address(self, address):
         if not self.client:
             raise ResourceError("Error, no client found.")
+        limiter.acquire(MAPS_API)
         return self.client.geocode(address)
 
     def get_nearby_places(self, *args, **kargs):
         if not self.client:
             raise ResourceError("Error, no client found.")
+        limiter.acquire(MAPS_API)
         return self.client.places_nearby(*args, **kargs)
 
     def set_place_details(self, place_id):
         if not self.client:
             raise ResourceError("Error, no client found.")
         try:
+            limiter.acquire(MAPS_API)
             place_details = self.client.place(place_id, language="ro")
         except Exception as e:
             print(e)
@@ -121,13 +129,35 @@ class MapClient:
 
 class ScrapeManager:
     """Parse and Scrape one domain"""
-    def __init__(self, access, map_client, connection, path=None):
+    def __init__(self, access, map_client, connection, path=None, cursor_file=r"assets\cursors"):
         self.access = access
         self.map_client = map_client
         self.connection = connection
         self.path = path
+        self.cursor_file = cursor_file
+        self.gazetteer = Gazetteer(connection)
         self.proxy_list = ProxyList()
-        self.download = download_file
+        # the scrapes run for hours, the pool is checked again and saved in the background
+        self.proxy_list.start_revalidation()
+
+    def load_cursor(self, job):
+        """Get the saved keyset cursor of a job, None if the job has to start from the beginning."""
+        try:
+            with open(self.cursor_file, "r") as f:
+                return loads(f.read()).get(job)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def save_cursor(self, job, cursor):
+        """Save the keyset cursor of a job, a None cursor marks the job as finished."""
+        try:
+            with open(self.cursor_file, "r") as f:
+                cursors = loads(f.read())
+        except (FileNotFoundError, ValueError):
+            cursors = {}
+        cursors[job] = cursor
+        with open(self.cursor_file, "w") as f:
+            f.write(dumps(cursors))
 
     def get_page_elements(self, url, tag, attribute_match=None, attributes_returned=None):
         """
@@ -138,128 +168,125 @@ class ScrapeManager:
         :param attributes_returned: list, strings or tuples with attribute values
         :return: list, BS elements matched with filtered results
         """
-        page = WebPage(url, self.proxy_list)
+        page = WebPage(url, self.proxy_list, parse_only=[tag])
         return page.match_elements(tag, attribute_match, attributes_returned)
 
     def dump(self, items):
         for item in items:
             keys = []
             for i in range(0, int(floor(int(item[1])/20)+1)):
-                page = WebPage(item[0] + "&start={}&order=".format(i*20))
+                page = WebPage(item[0] + "&start={}&order=".format(i*20), parse_only=["table"])
                 page_table = page.match_elements("table")[0]
+                new_churches = []
                 if len(keys) == 0:
                     for key in page_table.find_all("th"):
                         t = slugify(key.get_text())
                         if t:
                             keys.append(t)
+                church_dicts = []
                 for row in page_table.find_all("tr"):
                     columns = row.find_all("td")
                     if len(columns):
-                        church_dict = reflect_table(keys, columns[1:])
-                        church = Church(title=church_dict["denumire"][0],
-                                        url=church_dict["denumire"][1],
-                                        religion=church_dict["religie"][0],
-                                        photo_cnt=church_dict["fotografii"][0])
-                        check_church = self.connection.get(Church, {"url": church_dict["denumire"][1]}, "match")
-                        if not isinstance(check_church, Church):
-                            cod_lmi = str(church_dict["cod-lmi"][0]) if church_dict["cod-lmi"][0] != "" else None
-                            city_name = unidecode(church_dict["localitate"][0].lower())
-                            county_name = unidecode(church_dict["judet"][0].lower())
-                            if "Bucureşti" in county_name:
-                                county_name = "ilfov"
-                            if city_name == "bucuresti":
-                                county_name = "bucuresti"
-                            county = self.connection.get(County, {"name": county_name}, "match")
-                            city = self.connection.get(City,
-                                                       {"name": city_name, "county_id": county.id},
-                                                       "like")
-                            if church_dict["localizare"][0] == "*Biserică":
-                                lat, long = church_dict["localizare"][1].replace("Coordonate: ", "").split(",")
-                                geo_hash_id = hash_factors(lat, long, church.url)
-                            else:
-                                lat, long = None, None
-                                geo_hash_id = None
-                            try:
-                                church.update({"cod_lmi": cod_lmi,
-                                               "geo_hash_id": geo_hash_id,
-                                               "latitude": lat,
-                                               "longitude": long})
-                            except AttributeError:
-                                pass
-                            try:
-                                church.update({"city": city,
-                                               "city_id": city.id,
-                                               "county": city.county,
-                                               "county_id": city.county.id})
-                            except AttributeError:
-                                pass
-                            self.connection.post(church)
+                        church_dicts.append(reflect_table(keys, columns[1:]))
+                existing_urls = self.connection.existing_keys(Church, "url",
+                                                              [x["denumire"][1] for x in church_dicts])
+                for church_dict in church_dicts:
+                    church = Church(title=church_dict["denumire"][0],
+                                    url=church_dict["denumire"][1],
+                                    religion=church_dict["religie"][0],
+                                    photo_cnt=church_dict["fotografii"][0])
+                    if church_dict["denumire"][1] not in existing_urls:
+                        cod_lmi = str(church_dict["cod-lmi"][0]) if church_dict["cod-lmi"][0] != "" else None
+                        city, county = self.gazetteer.locate(church_dict["localitate"][0],
+                                                             church_dict["judet"][0])
+                        if church_dict["localizare"][0] == "*Biserică":
+                            lat, long = church_dict["localizare"][1].replace("Coordonate: ", "").split(",")
+                            geo_hash_id = hash_factors(lat, long, church.url)
+                        else:
+                            lat, long = None, None
+                            geo_hash_id = None
+                        try:
+                            church.update({"cod_lmi": cod_lmi,
+                                           "geo_hash_id": geo_hash_id,
+                                           "latitude": lat,
+                                           "longitude": long})
+                        except AttributeError:
+                            pass
+                        try:
+                            church.update({"city": city,
+                                           "city_id": city.id,
+                                           "county": city.county,
+                                           "county_id": city.county.id})
+                        except AttributeError:
+                            pass
+                        new_churches.append(church)
+                        existing_urls.add(church.url)
+                self.connection.post_many(Church, new_churches)
 
     def dump_2(self, items):
         for item in items:
-            default_county = self.connection.get(County, {"code": item[0].replace("/index.php?menu=BI", "")}, "match")
+            default_county = self.gazetteer.county(code=item[0].replace("/index.php?menu=BI", ""))
             default_church_count = int(item[1].replace(".", ""))
-            existing_church_count = len(self.connection.index(Church, None, {"county_id": default_county.id}, "match"))
+            existing_church_count = self.connection.count(Church, {"county_id": default_county.id})
             if default_church_count == existing_church_count:
                 continue
             keys = []
-            for i in range(0, int(floor(default_church_count/20)+1)):
-                page = WebPage(item[0] + "&start={}&order=".format(i*20))
+            page_urls = [item[0] + "&start={}&order=".format(i*20)
+                         for i in range(0, int(floor(default_church_count/20)+1))]
+            # the result pages are fetched concurrently and handled in the order they arrive
+            for page in WebPage.fetch_many(page_urls, parse_only=["table"]):
                 page_table = page.match_elements("table")[0]
+                new_churches = []
                 if len(keys) == 0:
                     for key in page_table.find_all("th"):
                         t = slugify(key.get_text())
                         if t:
                             keys.append(t)
+                church_dicts = []
                 for row in page_table.find_all("tr"):
                     columns = row.find_all("td")
                     if len(columns):
-                        church_dict = reflect_table(keys, columns[1:])
-                        church = Church(title=church_dict["denumire"][0],
-                                        url=church_dict["denumire"][1],
-                                        religion=church_dict["religie"][0],
-                                        photo_cnt=church_dict["fotografii"][0])
-                        check_church = self.connection.get(Church, {"url": church_dict["denumire"][1]}, "match")
-                        if not isinstance(check_church, Church):
-                            cod_lmi = str(church_dict["cod-lmi"][0]) if church_dict["cod-lmi"][0] != "" else None
-                            city_name = unidecode(church_dict["localitate"][0].lower())
-                            county_name = unidecode(church_dict["judet"][0].lower())
-                            if "Bucureşti" in county_name or "ucuresti" in county_name:
-                                county_name = "ilfov"
-                            if city_name == "bucuresti":
-                                county_name = "bucuresti"
-                            county = self.connection.get(County, {"name": county_name}, "match")
-                            try:
-                                city = self.connection.get(City, {"name": city_name, "county_id": county.id}, "like")
-                            except AttributeError:
-                                city = self.connection.get(City,
-                                                           {"name": city_name, "county_id": default_county.id},
-                                                           "like")
+                        church_dicts.append(reflect_table(keys, columns[1:]))
+                existing_urls = self.connection.existing_keys(Church, "url",
+                                                              [x["denumire"][1] for x in church_dicts])
+                for church_dict in church_dicts:
+                    church = Church(title=church_dict["denumire"][0],
+                                    url=church_dict["denumire"][1],
+                                    religion=church_dict["religie"][0],
+                                    photo_cnt=church_dict["fotografii"][0])
+                    if church_dict["denumire"][1] not in existing_urls:
+                        cod_lmi = str(church_dict["cod-lmi"][0]) if church_dict["cod-lmi"][0] != "" else None
+                        city, county = self.gazetteer.locate(church_dict["localitate"][0],
+                                                             church_dict["judet"][0],
+                                                             default_county)
+                        try:
+                            church.update({"city": city,
+                                           "city_id": city.id,
+                                           "county": city.county,
+                                           "county_id": city.county.id})
+                        except AttributeError:
+                            pass
+                        finally:
+                            church.update({"telephone": "new"})
+
+                        if church_dict["localizare"][0] == "*Biserică":
+                            lat, long = church_dict["localizare"][1].replace("Coordonate: ", "").split(",")
                             try:
-                                church.update({"city": city,
-                                               "city_id": city.id,
-                                               "county": city.county,
-                                               "county_id": city.county.id})
+                                church.update({"cod_lmi": cod_lmi,
+                                               "geo_hash_id": hash_factors(lat, long, church.url),
+                                               "latitude": lat,
+                                               "longitude": long})
                             except AttributeError:
                                 pass
-                            finally:
-                                church.update({"telephone": "new"})
-
-                            if church_dict["localizare"][0] == "*Biserică":
-                                lat, long = church_dict["localizare"][1].replace("Coordonate: ", "").split(",")
-                                try:
-                                    church.update({"cod_lmi": cod_lmi,
-                                                   "geo_hash_id": hash_factors(lat, long, church.url),
-                                                   "latitude": lat,
-                                                   "longitude": long})
-                                except AttributeError:
-                                    pass
 
-                            self.connection.post(church)
+                        new_churches.append(church)
+                        existing_urls.add(church.url)
+                self.connection.post_many(Church, new_churches)
 
     def parse(self):
         timestamp = datetime.datetime.fromtimestamp(time()).strftime('%Y-%m-%d %H:%M:%S')
-        interest_points = self.connection.index(InterestPoint, {"address_coord": None})
+        interest_points = self.connection.iter_index(InterestPoint, {"address_coord": None})
+        updates = []
         for int_point in interest_points:
             new_values = {}
             contact = {}
@@ -305,135 +332,163 @@ class ScrapeManager:
                                                          "administrative_area_level_1", "country"]:
                                 new_address.update({component["types"][0]: component["short_name"]})
                         packed_address = dumps(new_address, ensure_ascii=False)
-
-                        if int_point.city.name in packed_address and int_point.city.county.code in packed_address:
+                        # streamed rows can't lazy load, the city comes from the gazetteer
+                        city = self.gazetteer.cities[int_point.city_id]
+                        if city.name in packed_address and city.county.code in packed_address:
                             new_values.update({"address_coord": packed_address.encode("utf8")})
                             break
                 except KeyError:
                     pass
             if len(new_values):
-                self.connection.put(InterestPoint, int_point.id, new_values)
+                updates.append((int_point.id, new_values))
+            if len(updates) >= UPDATE_CHUNK:
+                self.connection.put_many(InterestPoint, updates)
+                updates = []
             # exit()
+        self.connection.put_many(InterestPoint, updates)
 
     def scrape_2(self, scrape_flag=None):
-        churches = self.connection.index(Church, None, {"telephone": "new", "address": None}, "match")
-        for church in churches:
-            new_values = {}
-            church_page = WebPage(church.url, self.proxy_list)
-            try:
-                if church_page.status_code != 200:
-                    new_values.update({"geo_hash_id": "error"})
-                    print("{} - url error, status: {}".format(church.url,
-                                                              church_page.status_code))
-                else:
-                    if not church.address or not church.city_id:
-                        address_fields = ["Localitate:", "Comună:", "Judeţ:", "Adresa:", "Cod poştal:"]
-                        interest_fields = ["Telefon :", "Adresă de e-mail :", "Detalii:"]
-                        contact, address = {}, {}
-                        page_table_rows = church_page.soup.find_all("tr")
-                        for row in list(reversed(page_table_rows[1:])):
-                            columns = row.find_all("td")
-                            if len(columns) < 2:
+        updates = []
+        checkpoint = self.load_cursor("scrape_2")
+        # images are stored once under the images folder and downloaded in the background while pages are parsed
+        downloader = ImageDownloader(self.path + "\\_store", self.proxy_list) if scrape_flag == "images" else None
+        downloads = []
+        for churches, cursor in self.connection.iter_pages(Church, {"telephone": "new", "address": None},
+                                                           limit=PAGE_SIZE, cursor=checkpoint):
+            page_churches = {church.url: church for church in churches}
+            # the pages of the whole batch are fetched concurrently and handled in the order they arrive
+            # only the rows of the details table, the links and the images of a church page are read
+            for church_page in WebPage.fetch_many(list(page_churches), self.proxy_list, parse_only=["tr", "a", "img"]):
+                church = page_churches[church_page.url]
+                new_values = {}
+                try:
+                    if church_page.status_code != 200:
+                        new_values.update({"geo_hash_id": "error"})
+                        print("{} - url error, status: {}".format(church.url,
+                                                                  church_page.status_code))
+                    else:
+                        if not church.address or not church.city_id:
+                            address_fields = ["Localitate:", "Comună:", "Judeţ:", "Adresa:", "Cod poştal:"]
+                            interest_fields = ["Telefon :", "Adresă de e-mail :", "Detalii:"]
+                            contact, address = {}, {}
+                            page_table_rows = church_page.soup.find_all("tr")
+                            for row in list(reversed(page_table_rows[1:])):
+                                columns = row.find_all("td")
+                                if len(columns) < 2:
+                                    continue
+                                first_cell = columns[0].get_text()
+                                second_cell = columns[1].get_text()
+
+                                if first_cell == "Judeţ:":
+                                    judet = self.gazetteer.county(second_cell)
+                                    try:
+                                        new_values.update({"county_id": judet.id})
+                                    except AttributeError:
+                                        print("{} - no matching county was found".format(second_cell))
+
+                                if first_cell == "Localitate:":
+                                    city_name = second_cell.split("-")[0] + "-"
+                                    oras = self.gazetteer.city(city_name, church.county_id)
+                                    try:
+                                        new_values.update({"city_id": oras.id})
+                                    except AttributeError:
+                                        print("{} - no matching city was found".format(second_cell))
+
+                                if first_cell in address_fields:
+                                    address.update({slugify(first_cell): str(second_cell)})
+
+                                if first_cell in interest_fields and "NU deţinem" not in second_cell:
+                                    if first_cell is "Telefon :":
+                                        new_values.update({"telephone": str(second_cell)})
+                                    contact.update({slugify(first_cell): second_cell})
+
+                            new_values.update(
+                                {"address": dumps(address, ensure_ascii=False).encode("utf8")})
+
+                        if not church.geo_hash_id:
+                            maps_url = church_page.soup.find("a", class_="fancybox-google")
+                            try:
+                                params = parse_qs(urlsplit(maps_url.attrs["href"]).query)
+                                lat, long = params["q"][0].split(",")
+                                new_values.update({"latitude": lat,
+                                                   "longitude": long,
+                                                   "geo_hash_id": hash_factors(lat, long, church.url)})
+                            except AttributeError:
                                 continue
-                            first_cell = columns[0].get_text()
-                            second_cell = columns[1].get_text()
-
-                            if first_cell == "Judeţ:":
-                                judet = self.connection.get(County, {"name": slugify(second_cell)})
-                                try:
-                                    new_values.update({"county_id": judet.id})
-                                except AttributeError:
-                                    print("{} - no matching county was found".format(second_cell))
-
-                            if first_cell == "Localitate:":
-                                city_name = second_cell.split("-")[0] + "-"
-                                oras = self.connection.get(City,
-                                                           {"name": city_name,
-                                                            "county_id": church.county_id},
-                                                           "like")
-                                try:
-                                    new_values.update({"city_id": oras.id})
-                                except AttributeError:
-                                    print("{} - no matching city was found".format(second_cell))
-
-                            if first_cell in address_fields:
-                                address.update({slugify(first_cell): str(second_cell)})
-
-                            if first_cell in interest_fields and "NU deţinem" not in second_cell:
-                                if first_cell is "Telefon :":
-                                    new_values.update({"telephone": str(second_cell)})
-                                contact.update({slugify(first_cell): second_cell})
-
-                        new_values.update(
-                            {"address": dumps(address, ensure_ascii=False).encode("utf8")})
-
-                    if not church.geo_hash_id:
-                        maps_url = church_page.soup.find("a", class_="fancybox-google")
-                        try:
-                            params = parse_qs(urlsplit(maps_url.attrs["href"]).query)
-                            lat, long = params["q"][0].split(",")
-                            new_values.update({"latitude": lat,
-                                               "longitude": long,
-                                               "geo_hash_id": hash_factors(lat, long, church.url)})
-                        except AttributeError:
-                            continue
 
-                    self.connection.put(Church, church.id, new_values)
-
-                    if church.photo_cnt >= 2 and scrape_flag == "images":
-                        img_path = self.path + "\\" + \
-                                   slugify(church.church_county.name) + "\\" + \
-                                   slugify(church.church_city.name) + "\\" + \
-                                   church.church_city.name + " - " + church.title
-                        # img_path = self.path + "\\" + slugify(church.church_city.name) +\
-                        #            "\\" + slugify(church.church_city.name + " " + church.title)
-                        church_imgs = []
-                        for img in church_page.get_images():
-                            if "zz_" in img:
-                                church_imgs.append(img.replace(church.url, "").replace("zz_", ""))
-                        if exists(img_path):
-                            current_files = [f for f in listdir(img_path) if isfile(join(img_path, f))]
-                        else:
-                            current_files = []
-                        if len(current_files):
-                            continue
-                        else:
-                            if len(church_imgs) > 10:
-                                church_imgs = church_imgs[:10]
-                            mk_dir(img_path)
-                            for k, img in enumerate(church_imgs):
-                                filename = basename(img)
-                                ext = splitext(filename)[1] if splitext(filename)[1] else ".jpg"
-                                try:
-                                    self.download(img, img_path + "\\" + str(k) + ext.lower(),
-                                                  self.proxy_list)
-                                except Exception as e:
-                                    print(e)
-                                else:
-                                    sleep(randint(2, 4))
+                        updates.append((church.id, new_values))
 
-            except AttributeError:
-                continue
+                        if church.photo_cnt >= 2 and scrape_flag == "images":
+                            # a county or city resolved on this page is only in new_values yet
+                            church_county = self.gazetteer.counties.get(new_values.get("county_id", church.county_id))
+                            church_city = self.gazetteer.cities.get(new_values.get("city_id", church.city_id))
+                            if church_county is None or church_city is None:
+                                print("{} - images skipped, no county or city".format(church.url))
+                                continue
+                            img_path = self.path + "\\" + \
+                                       slugify(church_county.name) + "\\" + \
+                                       slugify(church_city.name) + "\\" + \
+                                       church_city.name + " - " + church.title
+                            # img_path = self.path + "\\" + slugify(church.church_city.name) +\
+                            #            "\\" + slugify(church.church_city.name + " " + church.title)
+                            church_imgs = []
+                            for img in church_page.get_images():
+                                if "zz_" in img:
+                                    church_imgs.append(img.replace(church.url, "").replace("zz_", ""))
+                            if exists(img_path):
+                                current_files = [f for f in listdir(img_path) if isfile(join(img_path, f))]
+                            else:
+                                current_files = []
+                            if len(current_files):
+                                continue
+                            else:
+                                if len(church_imgs) > 10:
+                                    church_imgs = church_imgs[:10]
+                                mk_dir(img_path)
+                                for k, img in enumerate(church_imgs):
+                                    filename = basename(img)
+                                    ext = splitext(filename)[1] if splitext(filename)[1] else ".jpg"
+                                    downloads.append(downloader.submit(img, img_path + "\\" + str(k) + ext.lower()))
+
+                except AttributeError:
+                    continue
+            self.connection.put_many(Church, updates)
+            updates = []
+            # the cursor moves on once the images of the batch are on disk
+            wait(downloads)
+            downloads = []
+            self.save_cursor("scrape_2", cursor)
+        if downloader is not None:
+            downloader.close()
 
     def transfer_table(self):
         timestamp = datetime.datetime.fromtimestamp(time()).strftime('%Y-%m-%d %H:%M:%S')
         counties = self.connection.index(County)
         for county in counties:
-            churches = self.connection.index(Church, None, {"county_id": county.id, "telephone": "fixed"}, "match")
+            # the churches are only read, plain named rows skip the ORM instance construction
+            churches = self.connection.iter_index(Church, {"county_id": county.id, "telephone": "fixed"}, rows="named")
+            church_updates, interest_updates = [], []
             for church in churches:
                 interest_count = 0
                 geo_hash_id = hash_factors(church.longitude, church.latitude, church.url)
                 if church.geo_hash_id != geo_hash_id:
-                    self.connection.put(Church, church.id, {"geo_hash_id": geo_hash_id, "telephone": "fixed"})
-                interest_match = {"latitude": church.latitude, "longitude": church.longitude, "city_id": church.city_id}
-                interest_points = self.connection.index(InterestPoint, None, interest_match, "match")
+                    church_updates.append((church.id, {"geo_hash_id": geo_hash_id, "telephone": "fixed"}))
+                if church.latitude is None or church.longitude is None:
+                    interest_match = {"latitude": None, "longitude": None, "city_id": church.city_id}
+                    interest_points = self.connection.index(InterestPoint, interest_match, eager=["platforms"])
+                else:
+                    # the stored coordinates may have been rounded, match them by distance
+                    nearby = self.connection.within_radius(InterestPoint, church.latitude, church.longitude,
+                                                           MATCH_METERS, {"city_id": church.city_id},
+                                                           eager=["platforms"])
+                    interest_points = [x[0] for x in nearby]
                 if len(interest_points):
                     for int_p in interest_points:
                         if int_p.platforms[0].url == "biserici.org" + church.url:
                             interest_count += 1
                             if int_p.geo_hash_id != geo_hash_id:
-                                self.connection.put(InterestPoint, int_p.id, {"geo_hash_id": geo_hash_id})
-                                self.connection.put(Church, church.id, {"telephone": "moved"})
+                                interest_updates.append((int_p.id, {"geo_hash_id": geo_hash_id}))
+                                church_updates.append((church.id, {"telephone": "moved"}))
                     if interest_count > 1:
                         print("{} duplicates found of geo_hash_id: {} ".format(interest_count, geo_hash_id))
                 else:
@@ -455,28 +510,33 @@ class ScrapeManager:
                                   "photo_count": church.photo_cnt}, ensure_ascii=False).encode("utf8")
                     i_p.facilities.append(InterestPointFacility(geo_hash_id=geo_hash_id, type="info", content=info))
                     self.connection.post(i_p)
-                    self.connection.put(Church, church.id, {"telephone": "moved"})
+                    church_updates.append((church.id, {"telephone": "moved"}))
+            self.connection.put_many(InterestPoint, interest_updates)
+            self.connection.put_many(Church, church_updates)
 
     def fix_images(self, folder_path, new_path):
         if not folder_path:
             raise Exception("No path specified!")
 
-        counties = self.connection.index(County)
-        for county in counties:
-            county_folder = slugify(county.name)
-            cities = self.connection.index(City, {"county_id": county.id})
-            county_folder = join(folder_path, county_folder)
+        checkpoint = self.load_cursor("fix_images")
+        for cities, cursor in self.connection.iter_pages(City, limit=PAGE_SIZE, cursor=checkpoint):
             for city in cities:
+                county = city.county
+                if county is None:
+                    continue
+                county_folder = join(folder_path, slugify(county.name))
                 city_folder = slugify(city.name)
                 city_folder = join(county_folder, city_folder)
-                interests = self.connection.index(InterestPoint, {"city_id": city.id, "types": "place_of_worship"})
+                interests = self.connection.index(InterestPoint, {"city_id": city.id, "types": "place_of_worship"},
+                                                  eager=["facilities"])
+                updates = []
                 for interest in interests:
                     move_flag = False
                     info = loads(interest.facilities[0].content)
 
                     if info["photo_count"] < 2:
                         if interest.status != "invalid":
-                            self.connection.put(InterestPoint, interest.id, {"status": "invalid"})
+                            updates.append((interest.id, {"status": "invalid"}))
                         continue
 
                     output_path = join(new_path, slugify(county.name),
@@ -489,11 +549,8 @@ class ScrapeManager:
                                             slugify(city.name + " " + interest.title))
                     if not exists(interest_folder) or not len(listdir(interest_folder)):
                         if not exists(old_struc_folder):
-                            try:
-                                print(" No img folder found for interest {}: {} !".format(interest.title, interest.id))
-                                self.connection.put(InterestPoint, interest.id, {"status": "no_imgs"})
-                            except Exception as e:
-                                print(e)
+                            print(" No img folder found for interest {}: {} !".format(interest.title, interest.id))
+                            updates.append((interest.id, {"status": "no_imgs"}))
                             continue
                         interest_folder, old_struc_folder = old_struc_folder, interest_folder
                         move_flag = True
@@ -522,14 +579,14 @@ class ScrapeManager:
                         except Exception as e:
                             print(e)
                     if non_cropped >= info["photo_count"] - 1:
-                        self.connection.put(InterestPoint, interest.id, {"status": "invalid_imgs"})
+                        updates.append((interest.id, {"status": "invalid_imgs"}))
                     else:
-                        self.connection.put(InterestPoint,
-                                            interest.id,
-                                            {"photos": join(slugify(county.name),
-                                                            slugify(city.name),
-                                                            city.name + " - " + interest.title)})
+                        updates.append((interest.id, {"photos": join(slugify(county.name),
+                                                                     slugify(city.name),
+                                                                     city.name + " - " + interest.title)}))
                     # exit()
+                self.connection.put_many(InterestPoint, updates)
+            self.save_cursor("fix_images", cursor)
 
     def resize_and_crop(self, im, output_path, crop_size=(800, 600), limit_size=(500, 500)):
         """
@@ -583,3 +640,8 @@ class ScrapeManager:
 
 
 PLTFRM = compile(r"^(?:https?://)?(?:www\.)?((?:[\w|-]+\.)*[\w|-]+)(?:\.[a-z]+)")
+UPDATE_CHUNK = 500
+PAGE_SIZE = 100
+MATCH_METERS = 25
+MAPS_API = "googlemaps"
+PAGE_TOKEN_DELAY = 2
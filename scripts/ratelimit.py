@@ -0,0 +1,119 @@
+import asyncio
+from email.utils import parsedate_to_datetime
+from threading import Lock
+from time import monotonic, sleep, time
+from urllib.parse import urlsplit
+
+# queries per second and burst of a host or api, hosts not listed get DEFAULT_RATE
+DEFAULT_RATE = (1.0, 2)
+RATES = {
+    "googlemaps": (10.0, 10),
+    "biserici.org": (2.0, 4),
+    "www.booking.com": (1.0, 2),
+    "ro.wikipedia.org": (5.0, 10),
+}
+MAX_RETRY_AFTER = 600
+
+
+class TokenBucket:
+    """Token bucket of one host or api, tokens are reserved so waiting callers are served in order"""
+    def __init__(self, rate, burst):
+        """
+        :param rate: float, tokens added per second
+        :param burst: int, tokens that can pile up while the bucket is idle
+        """
+        self.rate = float(rate)
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = monotonic()
+        self.blocked_until = 0.0
+
+    def reserve(self):
+        """Take a token and return the seconds to wait before using it. Called with the limiter lock held."""
+        now = monotonic()
+        # during a back off the bucket refills from its end, callers queued behind it are spaced at the rate
+        start = max(now, self.blocked_until)
+        if start > self.updated:
+            self.tokens = min(self.burst, self.tokens + (start - self.updated) * self.rate)
+            self.updated = start
+        self.tokens -= 1
+        wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        return start - now + wait
+
+
+class RateLimiter:
+    """Token buckets shared by every worker of the process, one per host or api"""
+    def __init__(self, rates=None, default_rate=DEFAULT_RATE):
+        self.rates = dict(RATES if rates is None else rates)
+        self.default_rate = default_rate
+        self.buckets = {}
+        self.lock = Lock()
+
+    def configure(self, key, qps, burst=1):
+        """Set the rate of a host or api."""
+        with self.lock:
+            self.rates[key] = (qps, burst)
+            self.buckets.pop(key, None)
+
+    @staticmethod
+    def key(url):
+        """Bucket key of a url, its host."""
+        return urlsplit(url).hostname or url
+
+    def bucket(self, key):
+        if key not in self.buckets:
+            qps, burst = self.rates.get(key, self.default_rate)
+            self.buckets[key] = TokenBucket(qps, burst)
+        return self.buckets[key]
+
+    def reserve(self, key):
+        with self.lock:
+            return self.bucket(key).reserve()
+
+    def acquire(self, key):
+        """Wait until a request to a host or api is allowed."""
+        wait = self.reserve(key)
+        if wait > 0:
+            sleep(wait)
+
+    async def acquire_async(self, key):
+        """acquire for coroutines."""
+        wait = self.reserve(key)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def back_off(self, key, seconds):
+        """Stop all requests to a host or api for some seconds, e.g. after a 429."""
+        with self.lock:
+            bucket = self.bucket(key)
+            bucket.blocked_until = max(bucket.blocked_until, monotonic() + min(seconds, MAX_RETRY_AFTER))
+            # no tokens pile up while blocked, one request goes out when the block ends
+            bucket.tokens = min(bucket.tokens, 1.0)
+            bucket.updated = bucket.blocked_until
+
+    def throttled(self, key, status_code, headers):
+        """
+        Back off after a 429 or 503 response, for as long as its Retry-After header asks, otherwise for a
+        few seconds. Returns True if the request should be retried.
+        """
+        if status_code not in (429, 503):
+            return False
+        self.back_off(key, retry_after(headers.get("Retry-After")))
+        return True
+
+
+def retry_after(value, default=5.0):
+    """Seconds of a Retry-After header, given as seconds or as a http date."""
+    if not value:
+        return default
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time(), 0.0)
+    except (TypeError, ValueError):
+        return default
+
+
+limiter = RateLimiter()
@@ -1,18 +1,22 @@
-import requests
+import atexit
 import string
-import pickle
 import os
 import time
 from hashlib import md5
 from json import dumps, loads
 from .util import convert_coordinates
+from .frontier import Frontier
+from . import client, fetch
 from slugify import slugify
-from random import choice
-from fake_useragent import UserAgent
-from urllib.parse import quote, urlparse
-from requests.exceptions import ProxyError, ConnectTimeout, ReadTimeout
+from random import choices
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Lock, Thread
+from uuid import uuid4
+from urllib.parse import quote, urljoin, urlparse
+from requests.exceptions import ProxyError
 from urllib3 import Timeout
-from bs4 import BeautifulSoup, element
+from bs4 import BeautifulSoup, SoupStrainer, element
+import lxml.html
 from re import compile, search, findall, sub, I
 from scripts.exceptions import ResourceError
 
@@ -53,22 +57,15 @@ def download_file(url, file_path, proxy=None, timeout=Timeout(connect=5, read=20
         if os.path.isfile(file_path):
             print('{} - file already exists'.format(file_path))
             return
-        headers = {'user-agent': UserAgent().chrome}
-        if proxy is not None:
-            while True:
-                proxy_host = proxy.random()
-                try:
-                    response = requests.get(url,
-                                            headers=headers,
-                                            proxies={"http": proxy_host, "https": proxy_host},
-                                            stream=True,
-                                            timeout=timeout)
-                except (ProxyError, ConnectTimeout, ReadTimeout):
-                    continue
-                else:
-                    break
-        else:
-            response = requests.get(url, headers=headers, stream=True, timeout=timeout)
+        if client.cache() is not None:
+            response = client.fetch(url, proxy, timeout=timeout)
+            if response.status_code != 200:
+                print("Error {} on image {}".format(response.status_code, url))
+                return file_path
+            with open(file_path, 'wb') as output_file:
+                output_file.write(response.content)
+            return file_path
+        response = client.get(url, proxy, stream=True, timeout=timeout)
         try:
             response.raise_for_status()
             with open(file_path, 'wb') as output_file:
@@ -80,108 +77,192 @@ def download_file(url, file_path, proxy=None, timeout=Timeout(connect=5, read=20
             print("IOError on image {}".format(file_path))
         except Exception as e:
             print("Error {}".format(e))
+        finally:
+            # releases the connection of the shared session, also when the body was not read
+            response.close()
         return file_path
 
 
 class ProxyList:
-    """Crawl url and generate sitemap"""
-    def __init__(self, file=r"assets\proxies", logfile="proxy_list_errors.log"):
-        self.checked = set()
+    """Pool of validated proxies with their health, picked weighted by it and evicted after repeated failures"""
+    def __init__(self, file=r"assets\proxies", logfile="proxy_list_errors.log", workers=20, min_size=20):
+        """
+        :param file: string, json file with the proxies and their stats, kept between runs
+        :param logfile: string, log of the failed checks
+        :param workers: int, proxies checked at once
+        :param min_size: int, new candidates are fetched and checked when fewer proxies are left
+        """
+        self.file = file
+        self.workers = workers
+        self.min_size = min_size
+        self.lock = Lock()
+        self.logfile = open("logs\\" + logfile, "a")
+        self.revalidation = None
+        self.reports = 0
+        self.stats = {}
         try:
-            if os.stat(file).st_mtime < time.time() - 3 * 86400:
-                os.remove(file)
-            with open(file, 'rb') as f:
-                self.checked = pickle.load(f)
-        except FileNotFoundError:
-            self.logfile = open("logs\\" + logfile, "a")
-            self.queue = set()
-            break_flag = False
-            for i in range(0, 10):
-                ssl = False
-                if i % 2:
-                    response = requests.get("http://pubproxy.com/api/proxy?limit=20&format=txt&type=https")
-                    ssl = True
-                else:
-                    response = requests.get("http://pubproxy.com/api/proxy?limit=20&format=txt&type=http")
-
-                for item in response.text.split("\n"):
-                    if "We have to temporarily stop you" in item:
-                        break_flag = True
-                        break
-                    else:
-                        self.queue.update(["{}://{}".format("https" if ssl else "http", item)])
+            with open(file, "r") as f:
+                self.stats = loads(f.read())
+        except (FileNotFoundError, ValueError):
+            pass
+        stale = [proxy for proxy, entry in self.stats.items() if entry["checked"] < time.time() - PROXY_MAX_AGE]
+        if stale:
+            self.validate(stale)
+        if len(self.stats) < self.min_size:
+            self.validate(self.candidates())
+        self.save()
+        # what report() learned since the last save is kept when the process ends
+        atexit.register(self.save)
+
+    def __len__(self):
+        return len(self.stats)
+
+    def candidates(self):
+        """Proxies published by the public lists, not checked yet."""
+        queue = set()
+        break_flag = False
+        for i in range(0, 10):
+            ssl = False
+            if i % 2:
+                response = client.get("http://pubproxy.com/api/proxy?limit=20&format=txt&type=https")
+                ssl = True
+            else:
+                response = client.get("http://pubproxy.com/api/proxy?limit=20&format=txt&type=http")
 
-                if break_flag:
+            for item in response.text.split("\n"):
+                if "We have to temporarily stop you" in item:
+                    break_flag = True
                     break
+                else:
+                    queue.update(["{}://{}".format("https" if ssl else "http", item)])
 
-            response = requests.get("https://raw.githubusercontent.com/stamparm/aux/master/fetch-some-list.txt")
-            for item in loads(response.text):
-                try:
-                    if item["proto"] not in ["socks4", "socks5"]:
-                        self.queue.update(["{}://{}:{}".format(item["proto"], item["ip"], item["port"])])
-                except KeyError:
-                    pass
+            if break_flag:
+                break
 
-            response = requests.get("https://raw.githubusercontent.com/clarketm/proxy-list/master/proxy-list.txt")
-            for line, item in enumerate(response.text.split("\n")):
-                if 5 < line < 305:
-                    proxy_info = item.split(" ")
-                    try:
-                        proxy = "{}://{}".format("https" if proxy_info[1].endswith("S") else "http", proxy_info[0])
-                        self.queue.update([proxy])
-                    except Exception as e:
-                        print(e)
-
-            if gevent_installed:
-                self.pool = pool.Pool(10)
-                self.pool.spawn(self.parse_gevent)
-                self.pool.join()
-            else:
-                while len(self.queue) > 0:
-                    self.parse()
+        response = client.get("https://raw.githubusercontent.com/stamparm/aux/master/fetch-some-list.txt")
+        for item in loads(response.text):
+            try:
+                if item["proto"] not in ["socks4", "socks5"]:
+                    queue.update(["{}://{}:{}".format(item["proto"], item["ip"], item["port"])])
+            except KeyError:
+                pass
 
-            with open(file, "wb") as f:
-                pickle.dump(self.checked, f)
+        response = client.get("https://raw.githubusercontent.com/clarketm/proxy-list/master/proxy-list.txt")
+        for line, item in enumerate(response.text.split("\n")):
+            if 5 < line < 305:
+                proxy_info = item.split(" ")
+                try:
+                    proxy = "{}://{}".format("https" if proxy_info[1].endswith("S") else "http", proxy_info[0])
+                    queue.update([proxy])
+                except Exception as e:
+                    print(e)
+        return queue - set(self.stats)
 
     def is_valid(self, proxy_host, timeout=Timeout(connect=5, read=10)):
+        """Seconds a request through the proxy took, raises ProxyError if it doesn't hide our address."""
+        start = time.time()
         try:
-            response = requests.get("https://canihazip.com/s", proxies={"http": proxy_host, "https": proxy_host},
-                                    timeout=timeout)
+            response = client.session().get("https://canihazip.com/s",
+                                             proxies={"http": proxy_host, "https": proxy_host}, timeout=timeout)
         except Exception as e:
             raise ProxyError(e)
         else:
             if response.text != proxy_host.replace("http://", "").split(":")[0]:
                 raise ProxyError("Proxy check failed: {} not used while requesting".format(proxy_host))
-        self.checked.update([proxy_host])
+        return time.time() - start
 
-    def parse_gevent(self):
-        self.parse()
-        while len(self.queue) > 0 and not self.pool.full():
-            self.pool.spawn(self.parse_gevent)
+    def check(self, proxy_host):
+        try:
+            self.report(proxy_host, True, self.is_valid(proxy_host))
+        except Exception as e:
+            self.report(proxy_host, False)
+            self.errlog(str(e))
+
+    def validate(self, proxies):
+        """Check proxies concurrently, the working ones join the pool."""
+        proxies = list(proxies)
+        print("{} proxies in the pool :: checking {} proxies".format(len(self.stats), len(proxies)))
+        with ThreadPoolExecutor(self.workers) as executor:
+            list(executor.map(self.check, proxies))
+        print("{} proxies in the pool".format(len(self.stats)))
+
+    def report(self, proxy_host, success, latency=None):
+        """
+        Record the outcome of a request through a proxy. Unknown proxies only join the pool on success.
+        The stats are saved every PROXY_SAVE_EVERY reports.
+        """
+        with self.lock:
+            self.reports += 1
+            save = self.reports % PROXY_SAVE_EVERY == 0
+        if save:
+            self.save()
+        with self.lock:
+            entry = self.stats.get(proxy_host)
+            if entry is None:
+                if not success:
+                    return
+                entry = self.stats[proxy_host] = {"latency": latency, "successes": 0, "failures": 0, "strikes": 0,
+                                                  "checked": time.time()}
+            if success:
+                entry["successes"] += 1
+                entry["strikes"] = 0
+                entry["checked"] = time.time()
+                if latency is not None:
+                    entry["latency"] = latency if entry["latency"] is None else \
+                        (1 - LATENCY_WEIGHT) * entry["latency"] + LATENCY_WEIGHT * latency
+            else:
+                entry["failures"] += 1
+                entry["strikes"] += 1
+                if entry["strikes"] >= PROXY_STRIKES:
+                    del self.stats[proxy_host]
 
-    def parse(self):
-        if not gevent_installed:
-            print("{} proxies parsed :: {} proxies in the queue".format(len(self.checked), len(self.queue)))
-        else:
-            print("{} proxies parsed :: {} parsing processes :: {} proxies in the queue".format(len(self.checked),
-                                                                                                len(self.pool),
-                                                                                                len(self.queue)))
-        if not len(self.queue):
-            return
-        else:
-            proxy = self.queue.pop()
-            if proxy in self.checked:
-                return
-            try:
-                self.is_valid(proxy)
-            except Exception as e:
-                self.errlog(str(e))
+    @staticmethod
+    def score(entry):
+        """Health of a proxy, its smoothed success rate per second of latency."""
+        success_rate = (entry["successes"] + 1) / (entry["successes"] + entry["failures"] + 2)
+        return success_rate / max(entry["latency"] or 1.0, 0.05)
 
     def random(self):
-        if len(self.checked):
-            return choice(self.checked)
-        else:
-            raise ResourceError
+        """A proxy of the pool, the healthy and fast ones more often."""
+        with self.lock:
+            proxies = list(self.stats.items())
+        if not proxies:
+            raise ResourceError("No working proxies left")
+        return choices([x[0] for x in proxies], weights=[self.score(x[1]) for x in proxies])[0]
+
+    def refresh(self):
+        """Check every proxy of the pool again, top it up with new candidates and save it."""
+        self.validate(list(self.stats))
+        if len(self.stats) < self.min_size:
+            self.validate(self.candidates())
+        self.save()
+
+    def start_revalidation(self, interval=6 * 3600):
+        """Refresh the pool every interval seconds in a background thread, until stop_revalidation."""
+        stop = Event()
+
+        def revalidate():
+            while not stop.wait(interval):
+                try:
+                    self.refresh()
+                except Exception as e:
+                    self.errlog(str(e))
+        self.revalidation = stop
+        Thread(target=revalidate, daemon=True).start()
+
+    def stop_revalidation(self):
+        if self.revalidation is not None:
+            self.revalidation.set()
+            self.revalidation = None
+
+    def save(self):
+        with self.lock:
+            data = dumps(self.stats)
+        # written under a temporary name, a crash during the write never leaves a truncated file behind
+        temp_file = "{}.{}.tmp".format(self.file, uuid4().hex)
+        with open(temp_file, "w") as f:
+            f.write(data)
+        os.replace(temp_file, self.file)
 
     def errlog(self, msg):
         self.logfile.write(msg)
@@ -190,7 +271,11 @@ class ProxyList:
 
 class Crawler:
     """Crawl url and generate sitemap"""
-    def __init__(self, url, outputfile="output.xml", logfile="crawler_errors.log", oformat="xml", echo=True):
+    def __init__(self, url, outputfile="output.xml", logfile="crawler_errors.log", oformat="xml", echo=True,
+                 checkpoint=None):
+        """
+        :param checkpoint: string, sqlite file of the crawl state, default crawls\\<host>.sqlite
+        """
         self.url = url
         self.logfile = open("logs\\" + logfile, "a")
         self.oformat = oformat
@@ -199,10 +284,11 @@ class Crawler:
         self.echo = echo
         self.regex = None
 
-        # create lists for the urls in que and visited urls
         self.proxy_list = ProxyList()
-        self.urls = {[url]}
-        self.visited = set()
+        self.proxy_list.start_revalidation()
+        # queued and parsed urls are kept on disk, an interrupted crawl resumes where it stopped
+        self.frontier = Frontier(checkpoint or "crawls\\" + urlparse(url).hostname + ".sqlite")
+        self.frontier.push(url)
         self.exts = ["htm", "php"]
         self.allowed_regex = "\.((?!htm)(?!php)\w+)$"
 
@@ -225,8 +311,11 @@ class Crawler:
             self.pool.spawn(self.parse_gevent)
             self.pool.join()
         else:
-            while len(self.urls) > 0:
+            while len(self.frontier) > 0:
                 self.parse()
+        self.frontier.checkpoint()
+        self.proxy_list.stop_revalidation()
+        self.proxy_list.save()
         if self.oformat == 'xml':
             self.write_xml()
         elif self.oformat == 'txt':
@@ -234,36 +323,37 @@ class Crawler:
 
     def parse_gevent(self):
         self.parse()
-        while len(self.urls) > 0 and not self.pool.full():
+        while len(self.frontier) > 0 and not self.pool.full():
             self.pool.spawn(self.parse_gevent)
 
     def parse(self):
         if self.echo:
             if not gevent_installed:
-                print("{} pages parsed :: {} pages in the queue".format(len(self.visited), len(self.urls)))
+                print("{} pages parsed :: {} pages in the queue".format(self.frontier.parsed, len(self.frontier)))
             else:
-                print("{} pages parsed :: {} parsing processes :: {} pages in the queue".format(len(self.visited),
+                print("{} pages parsed :: {} parsing processes :: {} pages in the queue".format(self.frontier.parsed,
                                                                                                 len(self.pool),
-                                                                                                len(self.urls)))
+                                                                                                len(self.frontier)))
         # Set the starting point for the spider
-        if not len(self.urls):
+        item = self.frontier.pop()
+        if item is None:
             return
-        else:
-            url = self.urls.pop()
-            if url in self.visited:
+        url, depth = item
+        try:
+            # only the links are read, no soup is built
+            response = WebPage(url, self.proxy_list, parser="lxml.html", parse_only=["a"])
+            if response.status_code > 301:
+                self.errlog("Error {} at url {}".format(response.status_code, url))
                 return
-            try:
-                response = WebPage(url, self.proxy_list)
-                if response.status_code > 301:
-                    self.errlog("Error {} at url {}".format(response.status_code, url))
-                    return
-                for link in [x.replace("../", self.url) for x in response.get_links()]:
-                    if self.is_valid(link):
-                        self.urls.update([link])
-            except Exception as e:
-                self.errlog(str(e))
-            finally:
-                self.visited.update([url])
+            for link in response.get_links():
+                # relative links are resolved against the page, the frontier keeps their canonical form
+                link = urljoin(url, link)
+                if self.is_valid(link):
+                    self.frontier.push(link, depth + 1)
+        except Exception as e:
+            self.errlog(str(e))
+        finally:
+            self.frontier.done(url)
 
     def is_valid(self, url):
         parsed_url = urlparse(url)
@@ -282,48 +372,41 @@ class Crawler:
         self.logfile.write("\n")
 
     def write_xml(self):
-        of = open(self.outputfile, "w")
+        of = open(self.outputfile, "w", encoding="utf-8")
         of.write("<?xml version=\"1.0\" encoding=\"utf-8\"?>\n")
         of.write("<urlset xmlns=\"http://www.sitemaps.org/schemas/sitemap/0.9\""
                  " xmlns:xsi=\"http://www.w3.org/2001/XMLSchema-instance\""
                  " xsi:schemaLocation=\"http://www.sitemaps.org/schemas/sitemap/0.9"
                  " http://www.sitemaps.org/schemas/sitemap/0.9/sitemap.xsd\">\n")
         url_str = "<url><loc>{}</loc></url>\n"
-        while len(self.visited):
-            of.write(url_str.format(self.visited.pop().encode("utf-8")))
+        for url in self.frontier.visited():
+            of.write(url_str.format(url))
 
         of.write("</urlset>")
         of.close()
 
     def write_txt(self):
-        of = open(self.outputfile, "w")
+        of = open(self.outputfile, "w", encoding="utf-8")
         url_str = "{}\n"
-        while len(self.visited):
-            of.write(url_str.format(self.visited.pop()))
+        for url in self.frontier.visited():
+            of.write(url_str.format(url))
 
         of.close()
 
 
 class WebPage:
     """Generic webpage"""
-    def __init__(self, url, proxylist=None, timeout=Timeout(connect=5, read=20)):
+    def __init__(self, url, proxylist=None, timeout=Timeout(connect=5, read=20), parser=None, parse_only=None):
+        """
+        :param url: string
+        :param proxylist: ProxyList, the page is fetched through one of its proxies
+        :param timeout: urllib3 Timeout
+        :param parser: string, "lxml", "html.parser" or "html5lib" tree builder of the soup, or "lxml.html" to
+                       also read links straight from an lxml tree, default PARSER
+        :param parse_only: list, tag names, the soup only holds these tags and their children
+        """
         self.url = url
-        headers = {'user-agent':  UserAgent().chrome}
-        if proxylist is not None:
-            while True:
-                proxy_host = proxylist.random()
-                try:
-                    res = requests.get(url,
-                                       headers=headers,
-                                       proxies={"http": proxy_host, "https": proxy_host},
-                                       timeout=timeout)
-                except (ProxyError, ConnectTimeout, ReadTimeout):
-                    continue
-                else:
-                    break
-        else:
-            res = requests.get(url, headers=headers, timeout=timeout)
-        self.status_code = res.status_code
+        res = client.fetch(url, proxylist, timeout=timeout)
         try:
             response = res.content
             # response_encoding = detect(response)
@@ -331,9 +414,54 @@ class WebPage:
             #     response = response.decode("Windows-1250")
         except Exception as e:
             print(e)
-            self.soup = None
-        else:
-            self.soup = BeautifulSoup(response, "lxml")
+            response = None
+        self.load(res.status_code, response, parser, parse_only)
+
+    def load(self, status_code, content, parser=None, parse_only=None):
+        self.status_code = status_code
+        self.content = content
+        self.parser = parser or PARSER
+        self.parse_only = parse_only
+        self._soup = None
+        self._tree = None
+
+    @property
+    def soup(self):
+        """BeautifulSoup tree of the page, parsed on first use."""
+        if self._soup is None and self.content is not None:
+            strainer = SoupStrainer(self.parse_only) if self.parse_only else None
+            features = "lxml" if self.parser == "lxml.html" else self.parser
+            self._soup = BeautifulSoup(self.content, features, parse_only=strainer)
+        return self._soup
+
+    @soup.setter
+    def soup(self, value):
+        self._soup = value
+
+    @property
+    def tree(self):
+        """lxml tree of the page, parsed on first use, None if the page is empty."""
+        if self._tree is None and self.content:
+            self._tree = lxml.html.fromstring(self.content)
+        return self._tree
+
+    @classmethod
+    def from_content(cls, url, status_code, content, parser=None, parse_only=None):
+        """Page of an already fetched response."""
+        page = cls.__new__(cls)
+        page.url = url
+        page.load(status_code, content, parser, parse_only)
+        return page
+
+    @classmethod
+    def fetch_many(cls, urls, proxylist=None, concurrency=fetch.CONCURRENCY, per_host=fetch.PER_HOST, parser=None,
+                   parse_only=None):
+        """
+        Fetch many pages concurrently. Pages are yielded as they complete, not in the order of urls,
+        the ones that couldn't be fetched have None as status_code and soup.
+        """
+        for url, status_code, body in fetch.fetch_many(urls, proxylist, concurrency, per_host):
+            yield cls.from_content(url, status_code, body if status_code is not None else None, parser, parse_only)
 
     def match_elements(self, tag, attribute_match=None, attributes_returned=None):
         result = []
@@ -375,7 +503,7 @@ class WebPage:
             if striped_line:
                 cleaned_string = striped_line.translate(translator)
                 if len(striped_line) - len(cleaned_string) < 15 and len(cleaned_string) > 40:
-                    results.update({md5(striped_line.encode()): striped_line})
+                    results.update({md5(striped_line.encode()).hexdigest(): striped_line})
         return results
 
     def get_images(self):
@@ -388,6 +516,8 @@ class WebPage:
         return results
 
     def get_links(self):
+        if self.parser == "lxml.html" and self._soup is None:
+            return self.tree.xpath("//a/@href") if self.tree is not None else []
         return [x.attrs["href"] for x in self.soup.find_all('a', href=True)]
 
     def get_title(self):
@@ -410,7 +540,7 @@ class WebPage:
     def reflect_table(self, attributes_returned=None):
         results = []
         keys = []
-        page_table = self.soup.find("table")[0]
+        page_table = self.soup.find_all("table")[0]
         for heading in page_table.find_all("th"):
             key = slugify(heading.get_text())
             if isinstance(key, str):
@@ -506,6 +636,12 @@ class ListingPage(WebPage):
         pagedetails.update({"images": images, "short_description": self.get_metadata("description")})
         return pagedetails
 
+    def parse_listing(self):
+        """Details of parse_booking_page with the microformats of the page under "microformats"."""
+        details = self.parse_booking_page()
+        details.update({"microformats": self.get_microformats()})
+        return details
+
     def get_microformats(self):
         try:
             microformats_tag = self.soup.find("script", type="application/ld+json")
@@ -591,6 +727,12 @@ class GoogleResultPage:
         return results
 
 
+PROXY_MAX_AGE = 3 * 86400
+PROXY_STRIKES = 3
+PROXY_SAVE_EVERY = 100
+LATENCY_WEIGHT = 0.3
+# tree builder of the soup of every page, "lxml.html" reads links straight from an lxml tree, see WebPage
+PARSER = "lxml"
 PLTFRM = compile(r"^(?:https?://)?(?:www\.)?((?:[\w|-]+\.)*[\w|-]+)(?:\.[a-z]+)")
 PRC_PTN = compile("(?i)((?:\d{2,}\s*(?:euro|lei|ron|\$|€|£))|(?:(?:euro|lei|ron|\$|€|£)\s*\d{2,}))")
 LNK_PTN = compile('^(a|button)$', I)
@@ -11,12 +11,15 @@ import threading
         
         3. Start multi-threads with function process_parameters
         multi_threading.start_threads(process_parameters)
+
+        Pass the DataBaseView used by process_parameters as connection, each thread removes its session on exit
+        multi_threading = helpers.threads.MultiThreading(10, connection)
 """
 
 
 class ProcessingThread(threading.Thread):
     """Extending the Thread"""
-    def __init__(self, threadID, q, queueLock, func):
+    def __init__(self, threadID, q, queueLock, func, connection=None):
         threading.Thread.__init__(self)
         self.threadID = threadID
         self.name = "Thread " + str(threadID)
@@ -24,12 +27,18 @@ class ProcessingThread(threading.Thread):
         self.queueLock = queueLock
         self.empty_queue = 0
         self.inner_func = func
+        self.connection = connection
 
 
     def run(self):
         """Overwrite the threads.Thread run function to handle our calls"""
         print("Starting " + self.name)
-        self.process_data()
+        try:
+            self.process_data()
+        finally:
+            # the session of the thread holds a pooled connection until it is removed
+            if self.connection is not None:
+                self.connection.registry.remove()
         print("Exiting " + self.name)
 
 
@@ -57,8 +66,13 @@ class ProcessingThread(threading.Thread):
 
 class MultiThreading:
     """Multithread management"""
-    def __init__(self, max_threads):
+    def __init__(self, max_threads, connection=None):
+        """
+        :param max_threads: int
+        :param connection: DataBaseView, the sessions the threads opened on it are removed when they exit
+        """
         self.threadList = range(max_threads)
+        self.connection = connection
         self.queueLock = threading.Lock()
         self.workQueue = queue.Queue(max_threads)
         self.work_to_do = []
@@ -73,7 +87,7 @@ class MultiThreading:
         # Create new threads
         # inn_function -> function that will be called by each thread
         for thread_id in self.threadList:
-            thread = ProcessingThread(thread_id, self.workQueue, self.queueLock, inn_function)
+            thread = ProcessingThread(thread_id, self.workQueue, self.queueLock, inn_function, self.connection)
             thread.start()
             self.threads.append(thread)
 
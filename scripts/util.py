@@ -4,6 +4,7 @@ from csv import DictReader
 from hashlib import sha256
 from ast import literal_eval
 from difflib import SequenceMatcher
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
 import errno
 import glob
 
@@ -41,6 +42,17 @@ def hash_factors(*args):
     return sha256(str(result).encode()).hexdigest()
 
 
+def canonical_url(url):
+    """Url with a lower case scheme and host, no default port, no fragment and the query parameters sorted."""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    netloc = (parts.hostname or "").lower()
+    if parts.port and (scheme, parts.port) not in (("http", 80), ("https", 443)):
+        netloc += ":{}".format(parts.port)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, netloc, parts.path or "/", query, ""))
+
+
 def remove_non_ascii(s):
     return "".join(i for i in s if ord(i) < 128)
 
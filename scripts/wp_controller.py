@@ -194,10 +194,13 @@ class WordPressManager:
         except KeyError:
             pass
 
-        db_post = self.connection.get(InterestPoint, {"latitude": custom_fields_unpacked["latitude"],
-                                                      "longitude": custom_fields_unpacked["longitude"]})
+        # coordinates from the post are strings with fewer decimals than the stored floats
+        nearest = self.connection.nearest(InterestPoint, custom_fields_unpacked.get("latitude"),
+                                          custom_fields_unpacked.get("longitude"), 1, max_meters=25)
+        db_post = nearest[0][0] if nearest else None
         if not db_post:
-            db_post = self.connection.get(InterestPoint, {"title": post.title})
+            candidates = self.connection.search(InterestPoint, post.title, limit=1, threshold=0.8)
+            db_post = candidates[0][0] if candidates else None
 
         if not db_post:
             raise MissingResourceError("InterestPoint not found for post with id: {}.".format(post.id))